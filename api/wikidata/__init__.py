@@ -1 +1,3 @@
-from .wikidata_api import get_results, parse_wikidata
+from .wikidata_api import get_results, parse_wikidata, stream_wikidata
+from .snapshot import open_snapshot
+from .fetcher import open_partitioned
@@ -0,0 +1,303 @@
+import re
+import json
+import time
+import random
+import tempfile
+import http.client
+import urllib.error
+from collections import deque
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, wait
+import instrumentation
+from . import wikidata_api
+
+WORKERS = 4
+PAGES_AHEAD = 2
+TIMEOUT = 65
+RETRIES = 4
+BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+RETRY_STATUS = {429, 500, 502, 503, 504}
+SPOOL_SIZE = 16 * 1024 * 1024
+CANCEL_POLL = 0.2
+VALUES_CLAUSE = re.compile(r"VALUES\s+(\?\w+)\s*\{([^}]*)\}")
+HEAD = re.compile(r'"head"\s*:\s*')
+PROJECTION = re.compile(r"SELECT\s+(?:DISTINCT\s+|REDUCED\s+)?(.*?)\s+WHERE", re.IGNORECASE | re.DOTALL)
+
+
+class FetchError(OSError):
+    """
+    Raised when a request still fails after the last retry. It is an OSError, so callers handling
+    connection errors, like the stale snapshot fallback, handle it too.
+    """
+
+
+class FetchCancelled(Exception):
+    """
+    Raised when a fetch is stopped through its cancel event. It is not an OSError, so no stale snapshot is used instead.
+    """
+
+
+def check_cancel(cancel):
+    """
+    This function raises FetchCancelled if the cancel event is set. A cancel event of None never cancels.
+    """
+    if cancel is not None and cancel.is_set():
+        raise FetchCancelled()
+
+
+def partition_queries(sparql_query: str):
+    """
+    This function splits a query into one query per value of its first VALUES clause.
+    For the station query this gives a query for train stations and one for metro stations.
+    A query without a VALUES clause is returned as the only partition.
+
+    Args:
+        sparql_query (str): The query to split.
+
+    Returns:
+        list: The partition queries.
+    """
+    match = VALUES_CLAUSE.search(sparql_query)
+    if match is None:
+        return [sparql_query]
+    return [f"{sparql_query[:match.start()]}VALUES {match.group(1)} {{ {value} }}{sparql_query[match.end():]}"
+            for value in match.group(2).split()]
+
+
+def page_query(sparql_query: str, page: int, page_size: int = None):
+    """
+    This function returns the query for one page of a partition. A station has a row for every combination of its
+    types, lines and networks, so the rows are ordered by every projected variable. This is a total order,
+    and consecutive pages neither overlap nor skip rows.
+
+    Args:
+        sparql_query (str): The partition query.
+        page (int): The number of the page, starting at 0.
+        page_size (int, optional): The number of rows per page. Defaults to None, which returns the whole partition.
+
+    Returns:
+        str: The query text.
+
+    Raises:
+        ValueError: If a page size is given and the query does not name its projected variables.
+    """
+    if page_size is None:
+        return sparql_query
+    match = PROJECTION.search(sparql_query)
+    variables = re.findall(r"\?\w+", match.group(1)) if match else []
+    if not variables:
+        raise ValueError("Only queries selecting named variables can be paged")
+    return f"{sparql_query.rstrip()}\nORDER BY {' '.join(dict.fromkeys(variables))}\nLIMIT {page_size}\nOFFSET {page * page_size}\n"
+
+
+def retry_delay(error, attempt: int, backoff: float = BACKOFF):
+    """
+    This function returns how long to wait before retrying a failed request.
+    The Retry-After header of the response is honoured, otherwise the delay doubles with every attempt, with some jitter.
+
+    Args:
+        error (Exception): The error of the failed request.
+        attempt (int): The number of failed attempts so far, starting at 0.
+        backoff (float, optional): The delay after the first failure in seconds. Defaults to BACKOFF.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    retry_after = error.headers.get("Retry-After") if isinstance(error, urllib.error.HTTPError) and error.headers else None
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), MAX_BACKOFF)
+        except ValueError:
+            try:
+                return min(max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0), MAX_BACKOFF)
+            except (TypeError, ValueError):
+                pass
+    delay = min(backoff * 2 ** attempt, MAX_BACKOFF)
+    return delay + random.uniform(0, delay / 10)
+
+
+def page_head(page):
+    """
+    This function returns the head object of a SPARQL JSON result, read from the start of the file.
+    The file is positioned at the start again afterwards.
+
+    Returns:
+        dict: The head of the result, or an empty dict if it is not found in the first chunk.
+    """
+    prefix = page.read(wikidata_api.CHUNK_SIZE).decode("utf-8", errors="replace")
+    page.seek(0)
+    match = HEAD.search(prefix)
+    if match is None:
+        return {}
+    try:
+        return json.JSONDecoder().raw_decode(prefix, match.end())[0]
+    except json.JSONDecodeError:
+        return {}
+
+
+def fetch_page(endpoint: str, sparql_query: str, retries: int = RETRIES, backoff: float = BACKOFF, timeout: float = TIMEOUT,
+               cancel=None):
+    """
+    This function sends a query to an endpoint and copies the response to a temporary file, which is spilled to disk
+    above SPOOL_SIZE bytes. The file is then read back with iter_bindings to check that the bindings array is complete,
+    so the page is validated without holding its decoded bindings in memory.
+    Timeouts, connection errors, truncated or malformed responses and the HTTP status codes in RETRY_STATUS are retried
+    with exponential backoff. The endpoint reports a query timeout by cutting off a response that started with status 200,
+    which shows up as invalid JSON or an incomplete read.
+    Every request is recorded as a "fetch_page" stage, and every retry as a "retry" event.
+    The cancel event is checked before every attempt, between the chunks of the response and while waiting to retry.
+
+    Args:
+        endpoint (str): The endpoint URL.
+        sparql_query (str): The query to send.
+        retries (int, optional): The number of retries before giving up. Defaults to RETRIES.
+        backoff (float, optional): The delay after the first failure in seconds. Defaults to BACKOFF.
+        timeout (float, optional): The socket timeout in seconds. Defaults to TIMEOUT.
+        cancel (threading.Event, optional): When set, the fetch stops. Defaults to None.
+
+    Returns:
+        tuple: The number of bindings, and a binary file-like object with the result in JSON format, positioned at the start.
+
+    Raises:
+        FetchError: If the request still fails after the last retry.
+        FetchCancelled: If the cancel event is set.
+        urllib.error.HTTPError: If the request fails with a status that is not retried.
+    """
+    attempt = 0
+    while True:
+        check_cancel(cancel)
+        page = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        try:
+            with instrumentation.stage("fetch_page", attempt=attempt) as record:
+                with wikidata_api.open_results(endpoint, sparql_query, timeout) as response:
+                    while chunk := response.read1(wikidata_api.CHUNK_SIZE):
+                        check_cancel(cancel)
+                        page.write(chunk)
+                record["bytes"] = page.tell()
+                page.seek(0)
+                record["rows"] = rows = sum(1 for _ in wikidata_api.iter_bindings(page))
+                page.seek(0)
+            return rows, page
+        except urllib.error.HTTPError as error:
+            page.close()
+            if error.code not in RETRY_STATUS:
+                raise
+            if attempt >= retries:
+                raise FetchError(f"Request failed after {attempt + 1} attempts: {error}") from error
+            delay, reason = retry_delay(error, attempt, backoff), str(error)
+        except (OSError, http.client.HTTPException, ValueError) as error:
+            page.close()
+            if attempt >= retries:
+                raise FetchError(f"Request failed after {attempt + 1} attempts: {error!r}") from error
+            delay, reason = retry_delay(error, attempt, backoff), repr(error)
+        except BaseException:
+            page.close()
+            raise
+        instrumentation.emit("retry", attempt=attempt, delay=round(delay, 3), error=reason)
+        if cancel is None:
+            time.sleep(delay)
+        elif cancel.wait(delay):
+            raise FetchCancelled()
+        attempt += 1
+
+
+def fetch_results(endpoint: str, sparql_query: str, page_size: int = None, workers: int = WORKERS, cancel=None, **retry_options):
+    """
+    This function runs the partitions of a query concurrently on a bounded thread pool and yields the pages in order.
+    With a page size, every partition is fetched in LIMIT/OFFSET pages, with up to PAGES_AHEAD pages requested ahead,
+    until a page comes back with fewer rows than the page size.
+    The pages are yielded in the same order for the same data, whichever request finishes first.
+    While waiting for a page the cancel event is checked every CANCEL_POLL seconds. On cancel, the waiting stops,
+    and requests that are still running are left to finish in the background, since they check the event themselves.
+
+    Args:
+        endpoint (str): The endpoint URL.
+        sparql_query (str): The query to split into partitions.
+        page_size (int, optional): The number of rows per page. Defaults to None, which fetches each partition at once.
+        workers (int, optional): The maximum number of concurrent requests. Defaults to WORKERS.
+        cancel (threading.Event, optional): When set, the fetch stops with FetchCancelled. Defaults to None.
+        **retry_options: The retries, backoff and timeout passed on to fetch_page.
+
+    Yields:
+        tuple: The number of bindings and the file with the JSON result of each page, as returned by fetch_page.
+        The caller closes the files.
+    """
+    partitions = partition_queries(sparql_query)
+    next_page = [0] * len(partitions)
+    finished = [False] * len(partitions)
+    in_flight = [0] * len(partitions)
+    pending = deque()
+    pages_ahead = 1 if page_size is None else PAGES_AHEAD
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    def submit():
+        for partition, partition_query in enumerate(partitions):
+            while (not finished[partition] and in_flight[partition] < pages_ahead
+                   and (page_size is not None or next_page[partition] == 0)):
+                future = executor.submit(fetch_page, endpoint, page_query(partition_query, next_page[partition], page_size),
+                                         cancel=cancel, **retry_options)
+                pending.append((partition, future))
+                next_page[partition] += 1
+                in_flight[partition] += 1
+
+    try:
+        submit()
+        while pending:
+            partition, future = pending.popleft()
+            while not wait((future,), timeout=None if cancel is None else CANCEL_POLL).done:
+                check_cancel(cancel)
+            rows, page = future.result()
+            in_flight[partition] -= 1
+            if page_size is None or rows < page_size:
+                finished[partition] = True
+            yield rows, page
+            check_cancel(cancel)
+            submit()
+    finally:
+        for _, future in pending:
+            if not future.cancel() and future.done() and future.exception() is None:
+                future.result()[1].close()
+        executor.shutdown(wait=cancel is None or not cancel.is_set(), cancel_futures=True)
+
+
+def open_partitioned(endpoint: str = None, sparql_query: str = None, page_size: int = None, workers: int = WORKERS, cancel=None,
+                     **retry_options):
+    """
+    This function fetches a query as concurrent partitions and pages and merges them into a single SPARQL JSON result.
+    The bindings of each page are copied into the merged file one at a time, so memory use does not grow with the result.
+    It can be used wherever open_results is used.
+
+    Args:
+        endpoint (str, optional): The endpoint URL. Defaults to the global endpoint URL.
+        sparql_query (str, optional): The query to send. Defaults to the global query.
+        page_size (int, optional): The number of rows per page. Defaults to None, which fetches each partition at once.
+        workers (int, optional): The maximum number of concurrent requests. Defaults to WORKERS.
+        cancel (threading.Event, optional): When set, the fetch stops with FetchCancelled. Defaults to None.
+        **retry_options: The retries, backoff and timeout passed on to fetch_page.
+
+    Returns:
+        A binary file-like object with the merged results in JSON format, positioned at the start.
+    """
+    endpoint = endpoint or wikidata_api.endpoint_url
+    sparql_query = sparql_query or wikidata_api.load_query()
+    merged = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    try:
+        head, rows = None, 0
+        for _, page in fetch_results(endpoint, sparql_query, page_size, workers, cancel, **retry_options):
+            with page:
+                if head is None:
+                    head = page_head(page)
+                    merged.write(f'{{"head": {json.dumps(head)}, "results": {{"bindings": [\n'.encode("utf-8"))
+                for binding in wikidata_api.iter_bindings(page):
+                    if rows:
+                        merged.write(b",\n")
+                    merged.write(json.dumps(binding, ensure_ascii=False).encode("utf-8"))
+                    rows += 1
+        merged.write(b"\n]}}\n")
+        merged.seek(0)
+    except BaseException:
+        merged.close()
+        raise
+    return merged
@@ -0,0 +1,115 @@
+import os
+import gzip
+import time
+import shutil
+import hashlib
+import tempfile
+import instrumentation
+from . import wikidata_api, fetcher
+
+SNAPSHOT_DIRECTORY = os.path.join(os.path.dirname(__file__), "snapshots")
+DEFAULT_TTL = 24 * 60 * 60
+
+
+def snapshot_path(sparql_query: str, directory: str = SNAPSHOT_DIRECTORY):
+    """
+    This function returns the path of the snapshot for a query. Snapshots are keyed by a SHA-256 hash of the query text.
+
+    Args:
+        sparql_query (str): The query text.
+        directory (str, optional): The directory holding the snapshots. Defaults to SNAPSHOT_DIRECTORY.
+
+    Returns:
+        str: The path of the gzip compressed snapshot file.
+    """
+    key = hashlib.sha256(sparql_query.encode("utf-8")).hexdigest()
+    return os.path.join(directory, f"{key}.json.gz")
+
+
+def is_fresh(path: str, ttl: float):
+    """
+    This function checks whether a snapshot exists and is younger than the given time to live.
+
+    Args:
+        path (str): The path of the snapshot file.
+        ttl (float): The time to live in seconds.
+
+    Returns:
+        bool: True if the snapshot can be reused.
+    """
+    return os.path.exists(path) and time.time() - os.path.getmtime(path) < ttl
+
+
+def write_snapshot(stream, path: str):
+    """
+    This function copies a query result from a binary stream into a gzip compressed snapshot file.
+    The snapshot is written to a temporary file first and then moved into place, so an interrupted download
+    never replaces the last complete snapshot.
+
+    Args:
+        stream: A binary file-like object with the query result.
+        path (str): The path of the snapshot file.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as file, gzip.GzipFile(fileobj=file, mode="wb") as compressed:
+            shutil.copyfileobj(stream, compressed)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def open_snapshot(endpoint: str = None, sparql_query: str = None, ttl: float = DEFAULT_TTL, offline: bool = False,
+                  directory: str = SNAPSHOT_DIRECTORY, page_size: int = None, cancel=None):
+    """
+    This function returns a binary stream with the result of a query, using the on-disk snapshot cache.
+    A snapshot younger than the time to live is reused as is. Otherwise the query is fetched from the endpoint in
+    concurrent partitions, and the merged result is stored as the new snapshot. If the endpoint cannot be reached, the last snapshot is reused if there is one.
+    In offline mode the endpoint is never contacted and the last snapshot is returned regardless of its age.
+    Local fixture files given as endpoint are opened directly and never cached.
+
+    Args:
+        endpoint (str, optional): The endpoint URL, file:// URL or path. Defaults to the global endpoint URL.
+        sparql_query (str, optional): The query to send. Defaults to the global query.
+        ttl (float, optional): The time to live of a snapshot in seconds. Defaults to DEFAULT_TTL.
+        offline (bool, optional): A flag to only use the last snapshot. Defaults to False.
+        directory (str, optional): The directory holding the snapshots. Defaults to SNAPSHOT_DIRECTORY.
+        page_size (int, optional): Fetch every partition in pages of this many rows. Defaults to None, which fetches each partition at once.
+        cancel (threading.Event, optional): When set, the fetch stops and the last snapshot is kept. Defaults to None.
+
+    Returns:
+        A binary file-like object with the results of the query in JSON format.
+
+    Raises:
+        FileNotFoundError: If offline mode is requested and there is no snapshot for the query.
+        FetchCancelled: If the cancel event is set during the fetch.
+    """
+    endpoint = endpoint or wikidata_api.endpoint_url
+    sparql_query = sparql_query or wikidata_api.load_query()
+    if wikidata_api.is_local_endpoint(endpoint):
+        instrumentation.emit("snapshot", source="fixture", endpoint=endpoint)
+        return wikidata_api.open_results(endpoint, sparql_query)
+    path = snapshot_path(sparql_query, directory)
+    if offline:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No snapshot of the query in {directory}, run an online update first.")
+        instrumentation.emit("snapshot", source="offline", path=path)
+        return gzip.open(path, "rb")
+    if is_fresh(path, ttl):
+        instrumentation.emit("snapshot", source="cache", path=path)
+        return gzip.open(path, "rb")
+    try:
+        with instrumentation.stage("fetch", endpoint=endpoint, page_size=page_size) as record, \
+                fetcher.open_partitioned(endpoint, sparql_query, page_size, cancel=cancel) as response:
+            write_snapshot(response, path)
+            record["bytes"] = os.path.getsize(path)
+        instrumentation.emit("snapshot", source="endpoint", path=path)
+    except OSError as error:
+        if not os.path.exists(path):
+            raise
+        instrumentation.warn(f"Could not refresh the snapshot, using the last one instead: {error}", path=path)
+        instrumentation.emit("snapshot", source="stale", path=path)
+    return gzip.open(path, "rb")
@@ -1,8 +1,19 @@
+import os
 import sys
-from SPARQLWrapper import SPARQLWrapper, JSON
+import re
+import json
+import codecs
+import urllib.parse
+import urllib.request
+from string import Template
+import instrumentation
+from countries import COUNTRIES, DEFAULT_COUNTRY
 from database.data import Station
 from datetime import datetime
 
+CHUNK_SIZE = 64 * 1024
+QUERY_FILE = os.path.join(os.path.dirname(__file__), "wikidata.txt")
+
 
 def parse_date(date: str):
     """
@@ -18,6 +29,24 @@ def parse_date(date: str):
     return datetime.strptime(date, "%Y-%m-%dT%H:%M:%SZ").date()
 
 
+def load_query(country: str = DEFAULT_COUNTRY):
+    """
+    This function returns the SPARQL query from wikidata.txt for a country. The file is read on first use and kept in
+    the global query, and the $country placeholder is replaced by the Wikidata item of the country.
+
+    Args:
+        country (str, optional): The country code, one of COUNTRIES. Defaults to DEFAULT_COUNTRY.
+
+    Returns:
+        str: The query text.
+    """
+    global query
+    if query is None:
+        with open(QUERY_FILE) as file:
+            query = file.read()
+    return Template(query).substitute(country=COUNTRIES[country].wikidata_id)
+
+
 def get_results():
     """
     This function sends a SPARQL query to the global endpoint URL and returns the results in JSON format.
@@ -26,15 +55,136 @@ def get_results():
     Returns:
         dict: The results of the query in JSON format.
     """
-    global endpoint_url
-    global query
+    from SPARQLWrapper import SPARQLWrapper, JSON
     user_agent = "WDQS-example Python/%s.%s" % (sys.version_info[0], sys.version_info[1])
     sparql = SPARQLWrapper(endpoint_url, agent=user_agent)
-    sparql.setQuery(query)
+    sparql.setQuery(load_query())
     sparql.setReturnFormat(JSON)
     return sparql.query().convert()
 
 
+def is_local_endpoint(endpoint: str):
+    """
+    This function checks whether an endpoint refers to a local fixture file instead of a SPARQL server.
+
+    Args:
+        endpoint (str): A SPARQL endpoint URL, a file:// URL or a path to a JSON file.
+
+    Returns:
+        bool: True if the endpoint is a local file.
+    """
+    return urllib.parse.urlparse(endpoint).scheme in ("", "file")
+
+
+def open_results(endpoint: str = None, sparql_query: str = None, timeout: float = None):
+    """
+    This function sends a SPARQL query to an endpoint and returns the raw HTTP response,
+    so the JSON result can be read incrementally instead of being loaded into memory at once.
+    If the endpoint is a file:// URL or a local path, the file is opened as a stand-in for the query result.
+
+    Args:
+        endpoint (str, optional): The endpoint URL. Defaults to the global endpoint URL.
+        sparql_query (str, optional): The query to send. Defaults to the global query.
+        timeout (float, optional): The socket timeout in seconds. Defaults to no timeout.
+
+    Returns:
+        A binary file-like object with the results of the query in JSON format.
+    """
+    endpoint = endpoint or endpoint_url
+    sparql_query = sparql_query or load_query()
+    if is_local_endpoint(endpoint):
+        return open(urllib.request.url2pathname(urllib.parse.urlparse(endpoint).path), "rb")
+    user_agent = "WDQS-example Python/%s.%s" % (sys.version_info[0], sys.version_info[1])
+    request = urllib.request.Request(
+        f"{endpoint}?{urllib.parse.urlencode({'query': sparql_query, 'format': 'json'})}",
+        headers={"Accept": "application/sparql-results+json", "User-Agent": user_agent},
+    )
+    return urllib.request.urlopen(request, timeout=timeout)
+
+
+def iter_bindings(stream, chunk_size: int = CHUNK_SIZE):
+    """
+    This function reads a SPARQL JSON result from a binary stream and yields the entries of the
+    results.bindings array one at a time, keeping only a small window of the document in memory.
+
+    Args:
+        stream: A binary file-like object with a SPARQL JSON result.
+        chunk_size (int, optional): The number of bytes read from the stream at a time. Defaults to CHUNK_SIZE.
+
+    Yields:
+        dict: A single binding of the query result.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    eof = False
+
+    def read():
+        nonlocal buffer, eof
+        data = stream.read(chunk_size)
+        eof = not data
+        buffer += text_decoder.decode(data, final=eof)
+
+    start = re.compile(r'"bindings"\s*:\s*\[')
+    while (match := start.search(buffer)) is None:
+        if eof:
+            raise ValueError("SPARQL result does not contain a bindings array")
+        read()
+    position = match.end()
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position == len(buffer):
+            if eof:
+                raise ValueError("SPARQL result ended inside the bindings array")
+            buffer, position = "", 0
+            read()
+            continue
+        if buffer[position] == "]":
+            return
+        try:
+            binding, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            buffer, position = buffer[position:], 0
+            read()
+            continue
+        yield binding
+
+
+def parse_binding(result):
+    """
+    This function takes a single binding from a SPARQL query to Wikidata and parses it into a Station object.
+
+    Args:
+        result (dict): A single binding of the SPARQL query result.
+
+    Returns:
+        Station: The station represented by the binding.
+    """
+    data_dict = {
+        "station": result["station"]["value"],
+        "name": result["stationLabel"]["value"],
+        "uic_code": result["stationID"]["value"] if "stationID" in result else None,
+        "transport_network": result["transportNetworkLabel"]["value"] if "transportNetworkLabel" in result else None,
+        "address": result["address"]["value"] if "address" in result else None,
+        "type": result["BaneTypeLabel"]["value"] if "BaneTypeLabel" in result else None,
+        "connecting_line": result["connectingLineLabel"]["value"] if "connectingLineLabel" in result else None,
+        "opening_date": parse_date(result["openingDate"]["value"]) if "openingDate" in result else None,
+        "geo_latitude": float(result["geoLatitude"]["value"]) if "geoLatitude" in result else None,
+        "geo_longitude": float(result["geoLongitude"]["value"]) if "geoLongitude" in result else None
+    }
+    if data_dict["type"] == "S-tog line F":
+        data_dict["type"] = "F line"
+    if data_dict["type"] == "S-tog Bx":
+        data_dict["type"] = "Bx line"
+    if data_dict["type"] is not None:
+        if data_dict["type"].lower() in ["a", "b", "c", "e", "h", "bx", "f"]:
+            data_dict["type"] += " line"
+    return Station(**data_dict)
+
+
 def parse_wikidata(results):
     """
     This function takes the results from a SPARQL query to Wikidata and parses the data into a list of Station objects.
@@ -45,42 +195,43 @@ def parse_wikidata(results):
     Returns:
         list: A list of Station objects, each representing a station with its associated data.
     """
-    station_data = []
-    for result in results["results"]["bindings"]:
-        data_dict = {
-            "station": result["station"]["value"],
-            "name": result["stationLabel"]["value"],
-            "uic_code": result["stationID"]["value"] if "stationID" in result else None,
-            "transport_network": result["transportNetworkLabel"]["value"] if "transportNetworkLabel" in result else None,
-            "address": result["address"]["value"] if "address" in result else None,
-            "type": result["BaneTypeLabel"]["value"] if "BaneTypeLabel" in result else None,
-            "connecting_line": result["connectingLineLabel"]["value"] if "connectingLineLabel" in result else None,
-            "opening_date": parse_date(result["openingDate"]["value"]) if "openingDate" in result else None,
-            "geo_latitude": float(result["geoLatitude"]["value"]) if "geoLatitude" in result else None,
-            "geo_longitude": float(result["geoLongitude"]["value"]) if "geoLongitude" in result else None
-        }
-        if data_dict["type"] == "S-tog line F":
-            data_dict["type"] = "F line"
-        if data_dict["type"] == "S-tog Bx":
-            data_dict["type"] = "Bx line"
-        if data_dict["type"] is not None:
-            if data_dict["type"].lower() in ["a", "b", "c", "e", "h", "bx", "f"]:
-                data_dict["type"] += " line"
-
-        station_data.append(data_dict)
-        data_dict = None
-    stations = [Station(**data) for data in station_data]
-    return stations
-
-
-endpoint_url = "https://query.wikidata.org/sparql"
+    return [parse_binding(result) for result in results["results"]["bindings"]]
+
+
+def stream_wikidata(stream=None):
+    """
+    This function parses the results of a SPARQL query to Wikidata incrementally and yields a Station object per binding.
+    If no stream is given, the global query is sent to the global endpoint URL.
+    The time spent reading and decoding the JSON and the time spent parsing the bindings are recorded as the
+    "decode" and "parse" stages when the stream ends.
+
+    Args:
+        stream (optional): A binary file-like object with a SPARQL JSON result. Defaults to None.
+
+    Yields:
+        Station: A station with its associated data.
+    """
+    if stream is None:
+        with open_results() as response:
+            yield from stream_wikidata(response)
+        return
+    decode, parse = instrumentation.Timer("decode"), instrumentation.Timer("parse")
+    rows = 0
+    try:
+        for result in instrumentation.timed(iter_bindings(stream), decode):
+            with parse:
+                station = parse_binding(result)
+            rows += 1
+            yield station
+    finally:
+        decode.emit(rows=rows)
+        parse.emit(rows=rows)
+
+
+endpoint_url = os.environ.get("WIKIDATA_ENDPOINT", "https://query.wikidata.org/sparql")
+query = None
 
 if __name__ == "__main__":
-    with open("wikidata.txt") as file:
-        query = file.read()
     results = get_results()
     parsed_results = parse_wikidata(results)
     print(parsed_results)
-else:
-    with open("api/wikidata/wikidata.txt") as file:
-        query = file.read()
@@ -0,0 +1,77 @@
+import json
+import random
+
+VARIABLES = ["station", "stationLabel", "stationID", "transportNetworkLabel", "address", "BaneTypeLabel",
+             "connectingLineLabel", "openingDate", "geoLatitude", "geoLongitude"]
+TYPES = ["A", "B", "Bx", "C", "E", "H", "S-tog line F", "M1", "M2", "M3", "M4", "Regional rail", "Intercity"]
+NETWORKS = ["S-train Copenhagen", "Copenhagen Metro", "Aarhus Letbane", "Odense Letbane", "DSB", "Arriva"]
+SOUTH, WEST, NORTH, EAST = 54.5, 8.0, 57.8, 15.2
+
+
+def literal(value: str):
+    return {"type": "literal", "value": value}
+
+
+def generate_bindings(rows: int, seed: int = 0):
+    """
+    This function generates synthetic SPARQL bindings in the shape of the wikidata query result.
+    Like the real result, every station is repeated once per combination of its types, lines and networks,
+    and the optional values are sometimes missing. The same rows and seed always give the same bindings.
+
+    Args:
+        rows (int): The number of bindings to generate.
+        seed (int, optional): The seed of the random generator. Defaults to 0.
+
+    Yields:
+        dict: A single binding.
+    """
+    generator = random.Random(seed)
+    lines = [f"Line {number}banen" for number in range(max(10, rows // 200))]
+    generated, station_number = 0, 0
+    while generated < rows:
+        station_number += 1
+        base = {
+            "station": {"type": "uri", "value": f"http://www.wikidata.org/entity/Q{1000000 + station_number}"},
+            "stationLabel": {"xml:lang": "en", **literal(f"Station {station_number} {generator.choice(['Nord', 'Syd', 'Øst', 'Vest', 'H'])}")},
+            "geoLatitude": {"datatype": "http://www.w3.org/2001/XMLSchema#decimal", **literal(f"{generator.uniform(SOUTH, NORTH):.6f}")},
+            "geoLongitude": {"datatype": "http://www.w3.org/2001/XMLSchema#decimal", **literal(f"{generator.uniform(WEST, EAST):.6f}")},
+        }
+        if generator.random() < 0.8:
+            base["stationID"] = literal(f"{station_number:05d}")
+        if generator.random() < 0.3:
+            base["address"] = literal(f"Stationsvej {station_number % 100}")
+        if generator.random() < 0.9:
+            base["openingDate"] = {"datatype": "http://www.w3.org/2001/XMLSchema#dateTime",
+                                   **literal(f"{generator.randint(1847, 2024)}-{generator.randint(1, 12):02d}-{generator.randint(1, 28):02d}T00:00:00Z")}
+        types = generator.sample(TYPES, generator.choice([1, 1, 2, 3]))
+        station_lines = generator.sample(lines, generator.choice([1, 1, 1, 2]))
+        networks = generator.sample(NETWORKS, generator.choice([0, 1, 1, 2])) or [None]
+        for station_type in types:
+            for line in station_lines:
+                for network in networks:
+                    if generated == rows:
+                        return
+                    binding = dict(base, BaneTypeLabel=literal(station_type), connectingLineLabel=literal(line))
+                    if network is not None:
+                        binding["transportNetworkLabel"] = literal(network)
+                    yield binding
+                    generated += 1
+
+
+def write_document(file, rows: int, seed: int = 0):
+    """
+    This function writes a synthetic SPARQL JSON result document with generated bindings to a text file.
+    The bindings are written one at a time, so documents with millions of rows do not have to fit in memory.
+
+    Args:
+        file: A text file-like object to write to.
+        rows (int): The number of bindings to generate.
+        seed (int, optional): The seed of the random generator. Defaults to 0.
+    """
+    file.write(json.dumps({"head": {"vars": VARIABLES}})[:-1])
+    file.write(', "results": {"bindings": [\n')
+    for number, binding in enumerate(generate_bindings(rows, seed)):
+        if number:
+            file.write(",\n")
+        file.write(json.dumps(binding, ensure_ascii=False))
+    file.write("\n]}}\n")
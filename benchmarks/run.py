@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.generator import write_document
+from api.wikidata import stream_wikidata
+from database import sql
+from gui.markers import MarkerRegistry, ViewportRenderer
+from stations import SearchIndex, StationTable, parse_stations
+
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.jsonl")
+DEFAULT_ROWS = [1000, 10000, 100000]
+SEARCHES = [(["c line"], False), (["station 1"], False), (["1990", "a line"], False), (["a line", "nord"], True)]
+
+
+class FakeCanvas:
+    """
+    A stand-in for the Tkinter canvas of the map, which only counts the calls made to it.
+    """
+
+    def __init__(self):
+        self.deleted = 0
+
+    def delete(self, item):
+        self.deleted += 1
+
+    def update_idletasks(self):
+        pass
+
+
+class FakeMarker:
+    """
+    A stand-in for a map marker with the attributes used by MarkerRegistry.
+    """
+
+    def __init__(self, latitude, longitude, text):
+        self.position = (latitude, longitude)
+        self.text = text
+        self.polygon, self.big_circle, self.canvas_text, self.canvas_icon, self.canvas_image = 1, 2, 3, None, None
+        self.deleted = False
+
+    def set_position(self, latitude, longitude):
+        self.position = (latitude, longitude)
+
+    def set_text(self, text):
+        self.text = text
+
+
+class FakeMap:
+    """
+    A stand-in for TkinterMapView showing a fixed view, so the marker code can be timed without a display.
+    """
+
+    def __init__(self, zoom=12, south=55.5, west=12.2, north=55.9, east=12.8):
+        self.zoom = zoom
+        self.view = (south, west, north, east)
+        self.width, self.height = 800, 600
+        self.canvas = FakeCanvas()
+        self.canvas_marker_list = []
+
+    def set_marker(self, latitude, longitude, text=None, **options):
+        marker = FakeMarker(latitude, longitude, text)
+        self.canvas_marker_list.append(marker)
+        return marker
+
+    def convert_canvas_coords_to_decimal_coords(self, x, y):
+        south, west, north, east = self.view
+        return north - (north - south) * y / self.height, west + (east - west) * x / self.width
+
+
+@contextmanager
+def timed(timings, stage):
+    """
+    This function times the body of a with statement and stores the time in seconds under the name of the stage.
+    """
+    start = time.perf_counter()
+    yield
+    timings[stage] = round(time.perf_counter() - start, 6)
+
+
+def run(rows: int, seed: int = 0):
+    """
+    This function runs every benchmark stage once on a synthetic document with the given number of rows.
+    The database is written to a temporary file, so the real database is never touched.
+    The parse stage only parses the document. The db_load and db_refresh_unchanged stages both parse a fresh stream
+    of it while writing, like an update does, so the two are directly comparable and no parsed rows are kept in memory.
+
+    Args:
+        rows (int): The number of bindings in the synthetic document.
+        seed (int, optional): The seed of the generator. Defaults to 0.
+
+    Returns:
+        dict: The timings of the stages in seconds and the number of stations and markers involved.
+    """
+    timings, counts = {}, {"rows": rows}
+    database_directory = sql.DATABASE_DIRECTORY
+    with tempfile.TemporaryDirectory() as directory:
+        document = os.path.join(directory, "results.json")
+        with open(document, "w", encoding="utf-8") as file:
+            write_document(file, rows, seed)
+        sql.DATABASE_DIRECTORY = directory
+        sql.engines.clear()
+        try:
+            with timed(timings, "parse"), open(document, "rb") as stream:
+                counts["parsed"] = sum(1 for _ in stream_wikidata(stream))
+            with timed(timings, "db_load"), open(document, "rb") as stream:
+                sql.replace_stations(stream_wikidata(stream))
+            with timed(timings, "db_refresh_unchanged"), open(document, "rb") as stream:
+                sql.refresh_stations(stream_wikidata(stream))
+            with timed(timings, "select"):
+                table = StationTable(sql.iter_station_rows())
+        finally:
+            for engine in sql.engines.values():
+                engine.dispose()
+            sql.engines.clear()
+            sql.DATABASE_DIRECTORY = database_directory
+    counts["selected"] = len(table)
+
+    with timed(timings, "search_index"):
+        index = SearchIndex(table)
+    with timed(timings, "search"):
+        counts["search_results"] = sum(len(index.search(terms, match_all)) for terms, match_all in SEARCHES)
+    with timed(timings, "group"):
+        grouped = parse_stations(table)
+    with timed(timings, "describe"):
+        for station in grouped:
+            station.description
+    counts["stations"] = len(grouped)
+
+    third = len(grouped) // 3
+    registry = MarkerRegistry(FakeMap())
+    with timed(timings, "markers_add"):
+        registry.sync(grouped[:2 * third])
+    with timed(timings, "markers_diff"):
+        diff = registry.sync(grouped[third:])
+    counts.update({f"markers_{key}": value for key, value in diff.items()})
+
+    renderer = ViewportRenderer(FakeMap())
+    with timed(timings, "render"):
+        renderer.set_stations(grouped)
+    renderer.map_widget.zoom, renderer.map_widget.view = 14, (55.6, 12.4, 55.7, 12.6)
+    with timed(timings, "render_zoom"):
+        renderer.render()
+    counts["markers_rendered"] = len(renderer.registry)
+    return {"timings": timings, "counts": counts}
+
+
+def previous_results(path: str):
+    """
+    This function returns the last recorded result for each number of rows.
+    """
+    results = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    result = json.loads(line)
+                    results[result["counts"]["rows"]] = result
+    return results
+
+
+def report(result, previous=None):
+    """
+    This function prints the timings of a run, with the change since the previous run with the same number of rows.
+    """
+    print(f"rows={result['counts']['rows']} stations={result['counts']['stations']}")
+    for stage, seconds in result["timings"].items():
+        change = ""
+        if previous is not None and previous["timings"].get(stage):
+            change = f"  {seconds / previous['timings'][stage]:6.2f}x previous"
+        print(f"  {stage:22} {seconds * 1000:12.2f} ms{change}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time parsing, loading, searching, grouping and marker drawing on synthetic data.")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="The document sizes to run, up to about 1000000.")
+    parser.add_argument("--seed", type=int, default=0, help="The seed of the synthetic data generator.")
+    parser.add_argument("--output", default=RESULTS_FILE, help="The JSON lines file the results are appended to.")
+    arguments = parser.parse_args(argv)
+
+    previous = previous_results(arguments.output)
+    for rows in arguments.rows:
+        result = run(rows, arguments.seed)
+        result.update({"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "seed": arguments.seed,
+                       "python": platform.python_version(), "platform": platform.platform(), "processor": platform.processor()})
+        report(result, previous.get(rows))
+        with open(arguments.output, "a", encoding="utf-8") as file:
+            file.write(json.dumps(result) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+import sys
+import argparse
+import core
+import instrumentation
+from countries import COUNTRIES, ALL_COUNTRIES, resolve_countries
+
+
+def country_code(value):
+    """
+    This function checks a --country argument and returns it as an upper case country code, or "all".
+    """
+    try:
+        resolve_countries(value)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+    return ALL_COUNTRIES if value.lower() == ALL_COUNTRIES else value.upper()
+
+
+def print_stations(stations, arguments):
+    """
+    This function writes stations to standard output in the requested format.
+    """
+    core.export(stations, sys.stdout, arguments.format)
+
+
+def print_distances(results):
+    """
+    This function writes (distance, station) results to standard output, one station per line.
+    """
+    for distance, station in results:
+        print(f"{distance:.3f}\t{station.station_name}\t{station.geo_latitude}\t{station.geo_longitude}\t{station.station}")
+
+
+def run_update(arguments):
+    for country in resolve_countries(arguments.country):
+        counts = core.update(incremental=not arguments.full, offline=arguments.offline, snapshot_ttl=arguments.ttl,
+                             endpoint=arguments.endpoint, page_size=arguments.page_size, country=country)
+        print(f"{country} database updated: {counts}" if counts is not None else f"{country} database replaced")
+
+
+def run_status(arguments):
+    for country, state in core.refresh_state(arguments.country or ALL_COUNTRIES).items():
+        if state is None:
+            print(f"{country}\tnever refreshed")
+        else:
+            print(f"{country}\t{state['refreshed_at']:%Y-%m-%d %H:%M:%S}\t{state['mode']}\t{state['stations']} stations")
+
+
+def run_search(arguments):
+    if arguments.group:
+        print_stations(core.search_stations(arguments.terms.split(","), arguments.all, arguments.country), arguments)
+    else:
+        print_stations(core.search(arguments.terms.split(","), arguments.all, arguments.country), arguments)
+
+
+def run_export(arguments):
+    if arguments.group:
+        print_stations(core.search_stations([], countries=arguments.country), arguments)
+    else:
+        print_stations([station for country in resolve_countries(arguments.country) for station in core.load_stations(country)],
+                       arguments)
+
+
+def run_nearest(arguments):
+    print_distances(core.nearest(arguments.latitude, arguments.longitude, arguments.k, arguments.country))
+
+
+def run_radius(arguments):
+    print_distances(core.within_radius(arguments.latitude, arguments.longitude, arguments.radius, arguments.country))
+
+
+def run_bbox(arguments):
+    for station in core.within_bbox(arguments.south, arguments.west, arguments.north, arguments.east, arguments.country):
+        print(f"{station.station_name}\t{station.geo_latitude}\t{station.geo_longitude}\t{station.station}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Search and update the train and metro station databases of the supported countries without the GUI.")
+    parser.add_argument("--metrics", default=instrumentation.metrics_path,
+                        help=f"Append timing events as JSON lines to this file, or - for standard error. Defaults to ${instrumentation.METRICS_ENVIRONMENT}.")
+    parser.add_argument("--profile", default=instrumentation.profile_directory,
+                        help=f"Write cProfile statistics of the command to this directory. Defaults to ${instrumentation.PROFILE_ENVIRONMENT}.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    update_parser = commands.add_parser("update", help="Update the database from wikidata.")
+    update_parser.add_argument("--full", action="store_true", help="Replace all stations instead of only writing the changes.")
+    update_parser.add_argument("--offline", action="store_true", help="Rebuild the database from the last snapshot.")
+    update_parser.add_argument("--ttl", type=float, default=None, help="Reuse a snapshot younger than this many seconds.")
+    update_parser.add_argument("--endpoint", default=None, help="SPARQL endpoint URL, or a path to a JSON result file.")
+    update_parser.add_argument("--page-size", type=int, default=None, help="Fetch the query in pages of this many rows.")
+    update_parser.set_defaults(run=run_update)
+
+    for name, run, help_text in (("search", run_search, "Search stations by name, type, line, network or opening date."),
+                                 ("export", run_export, "Export all stations.")):
+        output_parser = commands.add_parser(name, help=help_text)
+        if name == "search":
+            output_parser.add_argument("terms", help="Search terms separated by comma, for example \"c line,aarhus\".")
+            output_parser.add_argument("--all", action="store_true", help="Only return stations matching all terms.")
+        output_parser.add_argument("--format", choices=core.EXPORT_FORMATS, default="csv", help="The output format.")
+        output_parser.add_argument("--group", action="store_true", help="Combine stations with the same name.")
+        output_parser.set_defaults(run=run)
+
+    nearest_parser = commands.add_parser("nearest", help="List the stations closest to a position.")
+    nearest_parser.add_argument("latitude", type=float)
+    nearest_parser.add_argument("longitude", type=float)
+    nearest_parser.add_argument("-k", type=int, default=5, help="The number of stations to list.")
+    nearest_parser.set_defaults(run=run_nearest)
+
+    radius_parser = commands.add_parser("radius", help="List the stations within a distance of a position.")
+    radius_parser.add_argument("latitude", type=float)
+    radius_parser.add_argument("longitude", type=float)
+    radius_parser.add_argument("radius", type=float, help="The distance in kilometres.")
+    radius_parser.set_defaults(run=run_radius)
+
+    bbox_parser = commands.add_parser("bbox", help="List the stations inside a bounding box.")
+    for side in ("south", "west", "north", "east"):
+        bbox_parser.add_argument(side, type=float)
+    bbox_parser.set_defaults(run=run_bbox)
+
+    status_parser = commands.add_parser("status", help="Show when each country was last refreshed.")
+    status_parser.set_defaults(run=run_status)
+
+    for command_parser in commands.choices.values():
+        command_parser.add_argument("--country", action="append", default=None, type=country_code,
+                                    help=f"A country code ({', '.join(COUNTRIES)}) or {ALL_COUNTRIES}, can be repeated. Defaults to DK, or all for status.")
+    return parser
+
+
+def main(argv=None):
+    arguments = build_parser().parse_args(argv)
+    instrumentation.configure(arguments.metrics, arguments.profile)
+    with instrumentation.profiled(arguments.command):
+        arguments.run(arguments)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,409 @@
+import csv
+import json
+import heapq
+from functools import lru_cache
+from itertools import islice
+import instrumentation
+from countries import DEFAULT_COUNTRY, resolve_countries
+from stations import SearchIndex, SpatialIndex, StationTable, ExistingStation, parse_stations
+
+EXPORT_FORMATS = ("csv", "json")
+SEARCH_CACHE_SIZE = 128
+
+search_indexes = {}
+spatial_indexes = {}
+summaries = {}
+versions = {}
+
+
+class RefreshCancelled(Exception):
+    """
+    Raised inside a refresh job when the user has cancelled it. The database transaction is rolled back.
+
+    Attributes:
+        committed (list): The countries whose update was already committed when several countries were updated.
+    """
+
+    def __init__(self, committed=()):
+        super().__init__()
+        self.committed = list(committed)
+
+
+def stop_on_cancel(iterable, cancel):
+    """
+    This function passes the items of an iterable through and raises RefreshCancelled as soon as cancel is set.
+
+    Args:
+        iterable (iterable): The items to pass through.
+        cancel (threading.Event): The cancel event of the refresh.
+
+    Yields:
+        The items of the iterable.
+    """
+    for item in iterable:
+        if cancel.is_set():
+            raise RefreshCancelled()
+        yield item
+
+
+def update(incremental: bool = True, offline: bool = False, snapshot_ttl: float = None, endpoint: str = None,
+           on_batch=None, cancel=None, page_size: int = None, country: str = DEFAULT_COUNTRY):
+    """
+    This function updates the database of a country with new data from wikidata.
+    It streams the results from wikidata through the snapshot cache, parses them incrementally, and writes them in
+    fixed-size batches in a single transaction. Only the database and indexes of the country are touched.
+    The update is recorded as an "update" stage with the counts, and is profiled if a profile directory is configured.
+
+    Args:
+        incremental (bool, optional): A flag to only write the stations that changed instead of replacing all of them. Defaults to True.
+        offline (bool, optional): A flag to rebuild the database from the last snapshot without querying wikidata. Defaults to False.
+        snapshot_ttl (float, optional): The time to live of a snapshot in seconds. Defaults to the snapshot cache default.
+        endpoint (str, optional): The SPARQL endpoint, file:// URL or path to query. Defaults to the wikidata endpoint.
+        on_batch (callable, optional): Called with the list of rows after each batch is written. Defaults to None.
+        cancel (threading.Event, optional): When set, the update stops and the database is left unchanged. It is checked
+            between the pages and retries of the download and between the parsed stations. Defaults to None.
+        page_size (int, optional): Fetch the query in LIMIT/OFFSET pages of this many rows. Defaults to None, which fetches each partition at once.
+        country (str, optional): The country code to update. Defaults to DEFAULT_COUNTRY.
+
+    Returns:
+        dict: The number of inserted, updated, deleted and unchanged stations in incremental mode, otherwise None.
+    """
+    from api.wikidata import stream_wikidata, open_snapshot
+    from api.wikidata.fetcher import FetchCancelled
+    from api.wikidata.wikidata_api import load_query
+    from api.wikidata.snapshot import DEFAULT_TTL
+    from database import sql
+    counts = None
+    with instrumentation.profiled(f"update-{country}"), \
+            instrumentation.stage("update", country=country, incremental=incremental, offline=offline) as record:
+        try:
+            snapshot = open_snapshot(endpoint, load_query(country), ttl=DEFAULT_TTL if snapshot_ttl is None else snapshot_ttl,
+                                     offline=offline, page_size=page_size, cancel=cancel)
+        except FetchCancelled as error:
+            raise RefreshCancelled() from error
+        with snapshot as stream:
+            parsed = stream_wikidata(stream)
+            if cancel is not None:
+                parsed = stop_on_cancel(parsed, cancel)
+            if incremental:
+                counts = sql.refresh_stations(parsed, on_batch=on_batch, country=country)
+                record.update(counts)
+            else:
+                sql.replace_stations(parsed, on_batch=on_batch, country=country)
+        invalidate(country)
+    return counts
+
+
+def refresh_state(countries=None):
+    """
+    This function returns the last refresh of each selected country.
+
+    Args:
+        countries (str or list, optional): A country code, "all", or a list of country codes. Defaults to DEFAULT_COUNTRY.
+
+    Returns:
+        dict: Maps each country code to a dict with refreshed_at, mode and stations, or None if it was never refreshed.
+    """
+    from database import sql
+    return {country: sql.get_refresh_state(country) for country in resolve_countries(countries)}
+
+
+def load_stations(country: str = DEFAULT_COUNTRY):
+    """
+    This function returns all stations in the database of a country, one per combination of type, line and network.
+    The rows are read straight into a compact StationTable, without creating ORM objects.
+    A country that was never updated has no stations, and no database is created for it.
+
+    Args:
+        country (str, optional): The country code. Defaults to DEFAULT_COUNTRY.
+
+    Returns:
+        StationTable: The stations. Iterating it yields StationRow objects with the Station attributes.
+    """
+    from database import sql
+    with instrumentation.stage("select", country=country) as record:
+        if sql.has_database(country):
+            stations = StationTable(sql.iter_station_rows(country=country), country)
+        else:
+            stations = StationTable(country=country)
+        record["rows"] = len(stations)
+    return stations
+
+
+def load_summary(country: str = DEFAULT_COUNTRY):
+    """
+    This function returns the stations of a country combined by name, as stored in the summary at the last refresh.
+    The stored descriptions are used as is, so no rows are grouped.
+
+    Args:
+        country (str, optional): The country code. Defaults to DEFAULT_COUNTRY.
+
+    Returns:
+        list: A list of ExistingStation objects with unique station names.
+    """
+    from database import sql
+    with instrumentation.stage("select_summary", country=country) as record:
+        stations = []
+        if sql.has_database(country):
+            stations = [ExistingStation.from_summary(
+                row.station, row.name, row.opening_date, row.geo_latitude, row.geo_longitude, json.loads(row.types),
+                json.loads(row.connecting_lines), json.loads(row.transport_networks), row.description, country)
+                for row in sql.iter_summary_rows(country)]
+        record["stations"] = len(stations)
+    return stations
+
+
+def check_version(country: str = DEFAULT_COUNTRY):
+    """
+    This function drops the indexes and cached data of a country if its data version changed since they were built,
+    for example because another process refreshed the country.
+
+    Returns:
+        int: The current data version of the country.
+    """
+    from database import sql
+    version = sql.data_version(country)
+    if versions.get(country) != version:
+        invalidate(country)
+        versions[country] = version
+    return version
+
+
+def get_summary(country: str = DEFAULT_COUNTRY):
+    """
+    This function returns the combined stations of a country. They are loaded on first use and reused until the data version changes.
+
+    Returns:
+        list: A list of ExistingStation objects with unique station names.
+    """
+    check_version(country)
+    if country not in summaries:
+        summaries[country] = load_summary(country)
+    return summaries[country]
+
+
+def get_search_index(country: str = DEFAULT_COUNTRY):
+    """
+    This function returns the search index over all stations of a country.
+    The index is built on first use and reused for every search until the data version of the country changes.
+
+    Returns:
+        SearchIndex: The search index.
+    """
+    check_version(country)
+    if country not in search_indexes:
+        stations = load_stations(country)
+        with instrumentation.stage("index", country=country, rows=len(stations)):
+            search_indexes[country] = SearchIndex(stations)
+    return search_indexes[country]
+
+
+def get_spatial_index(country: str = DEFAULT_COUNTRY):
+    """
+    This function returns the spatial index over all stations of a country, combined by name.
+    The index is built from the summary on first use and reused until the data version of the country changes.
+
+    Returns:
+        SpatialIndex: The spatial index.
+    """
+    stations = get_summary(country)
+    if country not in spatial_indexes:
+        spatial_indexes[country] = SpatialIndex(stations)
+    return spatial_indexes[country]
+
+
+def invalidate(country: str = None):
+    """
+    This function drops the indexes, summary and cached searches of a country, so they are rebuilt from the database on next use.
+    It is called after every update, and when the data version of a country changed.
+
+    Args:
+        country (str, optional): The country code. Defaults to None, which drops the data of all countries.
+    """
+    cached_search.cache_clear()
+    if country is None:
+        search_indexes.clear()
+        spatial_indexes.clear()
+        summaries.clear()
+        return
+    search_indexes.pop(country, None)
+    spatial_indexes.pop(country, None)
+    summaries.pop(country, None)
+
+
+def normalize_terms(terms):
+    """
+    This function turns search terms into the key of the search cache. Terms are stripped and lower cased, and empty
+    and repeated terms are dropped. The order of the terms does not change the result, so they are sorted.
+
+    Returns:
+        tuple: The normalized terms.
+    """
+    return tuple(sorted({term.strip().lower() for term in terms if term.strip()}))
+
+
+@lru_cache(maxsize=SEARCH_CACHE_SIZE)
+def cached_search(country: str, version: int, terms: tuple, match_all: bool):
+    """
+    This function searches a country and combines the matching stations by name. The results are kept in an LRU
+    cache keyed by the country, data version, normalized terms and match_all, so a repeated search is not recomputed.
+    """
+    index = get_search_index(country)
+    with instrumentation.stage("filter", country=country, terms=len(terms), match_all=match_all) as record:
+        found = index.search(list(terms), match_all)
+        record["rows"] = len(found)
+    return tuple(group(found))
+
+
+def search_stations(terms, match_all: bool = False, countries=None):
+    """
+    This function searches the stations like search, and returns them combined by name, as shown on the map.
+    Without search terms the stored summary is returned. Repeated searches are answered from an LRU cache,
+    which is invalidated automatically when the data version changes.
+
+    Args:
+        terms (list): A list of search terms. If no terms are given, all stations are returned.
+        match_all (bool, optional): A flag to require all terms to match. Defaults to False.
+        countries (str or list, optional): A country code, "all", or a list of country codes. Defaults to DEFAULT_COUNTRY.
+
+    Returns:
+        list: A list of ExistingStation objects, country by country.
+    """
+    key = normalize_terms(terms)
+    stations = []
+    for country in resolve_countries(countries):
+        if not key:
+            stations.extend(get_summary(country))
+            continue
+        version = check_version(country)
+        hits = cached_search.cache_info().hits
+        with instrumentation.stage("search", country=country, terms=len(key), match_all=match_all) as record:
+            found = cached_search(country, version, key, match_all)
+            record.update(stations=len(found), cached=cached_search.cache_info().hits > hits)
+        stations.extend(found)
+    return stations
+
+
+def search(terms, match_all: bool = False, countries=None):
+    """
+    This function searches the stations by name, type, line, network and opening date.
+    Only the indexes of the selected countries are built and searched.
+
+    Args:
+        terms (list): A list of search terms. If no terms are given, all stations are returned.
+        match_all (bool, optional): A flag to require all terms to match. Defaults to False.
+        countries (str or list, optional): A country code, "all", or a list of country codes. Defaults to DEFAULT_COUNTRY.
+
+    Returns:
+        list: The matching StationRow objects, country by country.
+    """
+    stations = []
+    for country in resolve_countries(countries):
+        index = get_search_index(country)
+        with instrumentation.stage("filter", country=country, terms=len(terms), match_all=match_all) as record:
+            found = index.search(terms, match_all)
+            record["rows"] = len(found)
+        stations.extend(found)
+    return stations
+
+
+def group(stations):
+    """
+    This function combines stations with the same name.
+
+    Args:
+        stations (iterable): Station objects.
+
+    Returns:
+        list: A list of ExistingStation objects with unique station names.
+    """
+    with instrumentation.stage("group") as record:
+        grouped = parse_stations(stations)
+        record["stations"] = len(grouped)
+    return grouped
+
+
+def nearest(latitude: float, longitude: float, k: int = 1, countries=None):
+    """
+    This function returns the k stations closest to a position, in the selected countries.
+
+    Returns:
+        list: Tuples of the distance in kilometres and the ExistingStation, closest first.
+    """
+    results = [get_spatial_index(country).nearest(latitude, longitude, k) for country in resolve_countries(countries)]
+    return list(islice(heapq.merge(*results, key=lambda result: result[0]), k))
+
+
+def within_radius(latitude: float, longitude: float, radius: float, countries=None):
+    """
+    This function returns the stations within radius kilometres of a position, in the selected countries.
+
+    Returns:
+        list: Tuples of the distance in kilometres and the ExistingStation, closest first.
+    """
+    results = [get_spatial_index(country).within_radius(latitude, longitude, radius) for country in resolve_countries(countries)]
+    return list(heapq.merge(*results, key=lambda result: result[0]))
+
+
+def within_bbox(south: float, west: float, north: float, east: float, countries=None):
+    """
+    This function returns the stations inside a bounding box, in the selected countries.
+
+    Returns:
+        list: The ExistingStation objects inside the box.
+    """
+    return [station for country in resolve_countries(countries)
+            for station in get_spatial_index(country).within_bbox(south, west, north, east)]
+
+
+def to_record(station):
+    """
+    This function converts a Station or ExistingStation to a dict of plain values for export.
+
+    Args:
+        station (Station or ExistingStation): The station to convert.
+
+    Returns:
+        dict: The fields of the station. Multiple types, lines and networks are joined with "; ".
+    """
+    if hasattr(station, "convert_to_dict"):
+        record = station.convert_to_dict()
+    else:
+        record = {
+            "station": station.station,
+            "name": station.station_name,
+            "type": "; ".join(station.station_types),
+            "connecting_line": "; ".join(station.connecting_lines),
+            "transport_network": "; ".join(station.transport_networks),
+            "opening_date": station.opening_date,
+            "geo_latitude": station.geo_latitude,
+            "geo_longitude": station.geo_longitude,
+        }
+    if record["opening_date"] is not None:
+        record["opening_date"] = record["opening_date"].isoformat()
+    return record
+
+
+def export(stations, file, export_format: str = "csv"):
+    """
+    This function writes stations to a text file as CSV or as a JSON array.
+
+    Args:
+        stations (iterable): Station or ExistingStation objects.
+        file: A text file-like object to write to.
+        export_format (str, optional): "csv" or "json". Defaults to "csv".
+
+    Raises:
+        ValueError: If the format is not supported.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format {export_format!r}, use one of {', '.join(EXPORT_FORMATS)}")
+    records = [to_record(station) for station in stations]
+    if export_format == "json":
+        json.dump(records, file, ensure_ascii=False, indent=2)
+        file.write("\n")
+        return
+    if records:
+        writer = csv.DictWriter(file, fieldnames=list(records[0]))
+        writer.writeheader()
+        writer.writerows(records)
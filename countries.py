@@ -0,0 +1,40 @@
+from collections import namedtuple
+
+Country = namedtuple("Country", ["wikidata_id", "name", "latitude", "longitude", "zoom"])
+
+COUNTRIES = {
+    "DK": Country("Q35", "Denmark", 55.668308, 12.384060, 8),
+    "SE": Country("Q34", "Sweden", 62.0, 15.0, 5),
+    "DE": Country("Q183", "Germany", 51.2, 10.4, 6),
+    "NO": Country("Q20", "Norway", 64.5, 12.0, 5),
+}
+DEFAULT_COUNTRY = "DK"
+ALL_COUNTRIES = "all"
+
+
+def resolve_countries(countries=None):
+    """
+    This function turns a country selection into a list of country codes.
+
+    Args:
+        countries (str or iterable, optional): A country code, "all", or several country codes. Defaults to None, which selects the default country.
+
+    Returns:
+        list: The selected country codes, in the order of COUNTRIES for "all".
+
+    Raises:
+        ValueError: If a country code is not in COUNTRIES.
+    """
+    if countries is None:
+        return [DEFAULT_COUNTRY]
+    if isinstance(countries, str):
+        countries = [countries]
+    codes = []
+    for country in countries:
+        if country.lower() == ALL_COUNTRIES:
+            return list(COUNTRIES)
+        if country.upper() not in COUNTRIES:
+            raise ValueError(f"Unknown country {country!r}, use one of {', '.join(COUNTRIES)} or {ALL_COUNTRIES}")
+        if country.upper() not in codes:
+            codes.append(country.upper())
+    return codes
@@ -1,11 +1,13 @@
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import Column
-from sqlalchemy import String, Float, Date, PickleType
+from sqlalchemy import Column, ForeignKey, Index
+from sqlalchemy import String, Float, Date, DateTime, Integer, PickleType
 
 Base = declarative_base()
 
 
 class Station(Base):
+    # One row per combination of multi-valued properties. Since the normalized schema was introduced,
+    # "Station" is a read-only view over StationEntity and its type, line and network tables.
     __tablename__ = "Station"
     station = Column(String, primary_key=True, nullable=False)
     name = Column(String, primary_key=True, nullable=False)
@@ -38,4 +40,67 @@ class Station(Base):
     def convert_to_dict(self):
         return {
             "station": self.station, "name": self.name, "uic_code": self.uic_code, "transport_network": self.transport_network, "address": self.address, "type": self.type, "connecting_line": self.connecting_line, "opening_date": self.opening_date, "geo_latitude": self.geo_latitude, "geo_longitude": self.geo_longitude
-        }
\ No newline at end of file
+        }
+
+
+class StationEntity(Base):
+    # One row per Wikidata station entity.
+    __tablename__ = "station_entity"
+    station = Column(String, primary_key=True, nullable=False)
+    name = Column(String, nullable=False, index=True)
+    uic_code = Column(String, nullable=True)
+    address = Column(String, nullable=True)
+    opening_date = Column(Date, nullable=True)
+    geo_latitude = Column(Float, nullable=False)
+    geo_longitude = Column(Float, nullable=False)
+
+    __table_args__ = (Index("ix_station_entity_coordinates", "geo_latitude", "geo_longitude"),)
+
+
+class StationType(Base):
+    __tablename__ = "station_type"
+    station = Column(String, ForeignKey("station_entity.station", ondelete="CASCADE"), primary_key=True, nullable=False)
+    type = Column(String, primary_key=True, nullable=False)
+
+
+class StationLine(Base):
+    __tablename__ = "station_line"
+    station = Column(String, ForeignKey("station_entity.station", ondelete="CASCADE"), primary_key=True, nullable=False)
+    connecting_line = Column(String, primary_key=True, nullable=False)
+
+
+class StationNetwork(Base):
+    __tablename__ = "station_network"
+    station = Column(String, ForeignKey("station_entity.station", ondelete="CASCADE"), primary_key=True, nullable=False)
+    transport_network = Column(String, primary_key=True, nullable=False)
+
+
+class RefreshState(Base):
+    # The last refresh of the country stored in the database, written in the same transaction as the stations.
+    __tablename__ = "refresh_state"
+    country = Column(String, primary_key=True, nullable=False)
+    refreshed_at = Column(DateTime, nullable=False)
+    mode = Column(String, nullable=False)
+    stations = Column(Integer, nullable=False)
+    # Increased by every refresh, so readers can tell that their cached data is out of date.
+    version = Column(Integer, nullable=False, default=0)
+
+
+class StationSummary(Base):
+    # One row per station name, as combined by parse_stations, updated in the same transaction as every refresh.
+    # The types, lines and networks are JSON lists, and position keeps the order of the combined stations.
+    __tablename__ = "station_summary"
+    position = Column(Integer, primary_key=True, nullable=False)
+    station = Column(String, nullable=False)
+    name = Column(String, nullable=False, index=True)
+    opening_date = Column(Date, nullable=True)
+    geo_latitude = Column(Float, nullable=False)
+    geo_longitude = Column(Float, nullable=False)
+    types = Column(String, nullable=False)
+    connecting_lines = Column(String, nullable=False)
+    transport_networks = Column(String, nullable=False)
+    description = Column(String, nullable=False)
+
+
+# The multi-valued Station columns and the table that holds each of them in the normalized schema.
+MULTI_VALUED = {"type": StationType, "connecting_line": StationLine, "transport_network": StationNetwork}
@@ -1,7 +1,17 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import create_engine, select, update, delete
-from datetime import date
-from database.data import Station, Base
+from sqlalchemy import create_engine, select, update, delete, text, func, Table, MetaData, Column
+from sqlalchemy.dialects.sqlite import insert
+from datetime import date, datetime
+from itertools import islice, groupby
+import os
+import json
+import hashlib
+import threading
+import instrumentation
+from countries import DEFAULT_COUNTRY
+from database.data import Station, StationEntity, StationSummary, RefreshState, MULTI_VALUED, Base
+from stations.grouping import parse_stations
+from stations.model import COLUMNS
 
 from sqlalchemy.engine import Engine
 from sqlalchemy import event
@@ -11,14 +21,48 @@ from sqlalchemy import event
 def set_sqlite_pragma(dbapi_connection, connection_record):
     cursor = dbapi_connection.cursor()
     cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA journal_mode=WAL")
     cursor.close()
 
 
-Database = "sqlite:///database/data.db"
+DATABASE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+BATCH_SIZE = 500
+INCOMING_TABLE = "incoming_station"
+ENTITY_COLUMNS = [column.name for column in StationEntity.__table__.columns]
+NORMALIZED_TABLES = [StationEntity.__table__] + [table.__table__ for table in MULTI_VALUED.values()]
+# The order Station rows are combined in, so every path picks the same representative entity and attribute order for a name.
+STATION_ORDER = (Station.station, Station.type, Station.connecting_line, Station.transport_network)
 
+# The legacy flat Station rows, rebuilt from the normalized tables, so select_all(Station) keeps working.
+STATION_VIEW = """
+CREATE VIEW "Station" AS
+SELECT entity.station, entity.name, entity.uic_code, network.transport_network, entity.address,
+       type.type, line.connecting_line, entity.opening_date, entity.geo_latitude, entity.geo_longitude
+FROM station_entity AS entity
+LEFT JOIN station_type AS type ON type.station = entity.station
+LEFT JOIN station_line AS line ON line.station = entity.station
+LEFT JOIN station_network AS network ON network.station = entity.station
+"""
 
-def select_all(classparam):
-    with Session(engine) as session:
+
+def database_path(country: str = DEFAULT_COUNTRY):
+    """
+    Return the path of the database of a country. Every country is stored in a file of its own, so refreshing or
+    reading one country never touches the others. Denmark keeps the original data.db.
+    """
+    name = "data.db" if country == DEFAULT_COUNTRY else f"data_{country.lower()}.db"
+    return os.path.join(DATABASE_DIRECTORY, name)
+
+
+def has_database(country: str = DEFAULT_COUNTRY):
+    """
+    Check whether the database of a country exists, without creating it.
+    """
+    return country in engines or os.path.exists(database_path(country))
+
+
+def select_all(classparam, country: str = DEFAULT_COUNTRY):
+    with Session(get_engine(country)) as session:
         records = session.scalars(select(classparam))
         result = []
         for record in records:
@@ -26,22 +70,394 @@ def select_all(classparam):
     return result
 
 
-def clear_station():
-    with Session(engine) as session:
-        stations = select_all(Station)
-        for station in stations:
-            session.execute(delete(Station).where(Station.name == station.name))
+def iter_station_rows(batch_size: int = BATCH_SIZE, country: str = DEFAULT_COUNTRY):
+    """
+    Yield the flat Station rows of a country as plain SQL result rows, fetched in batches and without ORM objects.
+    The rows have the Station columns as attributes, in the COLUMNS order of StationTable, so the table can read them by position.
+    They are ordered by STATION_ORDER, like the rows the summary is combined from, so grouping search results picks
+    the same entity and attribute order for a name as the summary.
+    """
+    columns = [Station.__table__.c[column] for column in COLUMNS]
+    with get_engine(country).connect() as connection:
+        result = connection.execution_options(yield_per=batch_size).execute(select(*columns).order_by(*STATION_ORDER))
+        yield from result
+
+
+def delete_stations(session, keys=None):
+    """
+    Delete station entities and their types, lines and networks. All entities are deleted if no keys are given.
+    """
+    for table in [*MULTI_VALUED.values(), StationEntity]:
+        if keys is None:
+            session.execute(delete(table))
+        else:
+            session.execute(delete(table).where(table.station.in_(keys)))
+
+
+def clear_station(country: str = DEFAULT_COUNTRY):
+    with Session(get_engine(country)) as session:
+        delete_stations(session)
         session.commit()
 
 
-def create_record(record):
-    with Session(engine) as session:
-        session.add(record)
+def record_refresh(session, country: str, mode: str, changed: bool = True, names=None):
+    """
+    Store the time and mode of a refresh of a country and the number of stored station entities.
+    If the stations changed, the data version is increased and the combined stations in station_summary are rebuilt,
+    only for the given station names if there are any.
+    """
+    version = session.execute(select(RefreshState.version).where(RefreshState.country == country)).scalar() or 0
+    if changed:
+        if names is None:
+            rebuild_summary(session)
+        else:
+            update_summary(session, names)
+        version += 1
+    values = {"refreshed_at": datetime.now(), "mode": mode, "version": version,
+              "stations": session.execute(select(func.count()).select_from(StationEntity)).scalar()}
+    session.execute(insert(RefreshState.__table__).values(country=country, **values)
+                    .on_conflict_do_update(index_elements=["country"], set_=values))
+
+
+def get_refresh_state(country: str = DEFAULT_COUNTRY):
+    """
+    Return the last refresh of a country as a dict with refreshed_at, mode, stations and version, or None if it was never refreshed.
+    """
+    if not has_database(country):
+        return None
+    with get_engine(country).connect() as connection:
+        row = connection.execute(select(RefreshState.__table__).where(RefreshState.country == country)).first()
+    return None if row is None else dict(row._mapping)
+
+
+def data_version(country: str = DEFAULT_COUNTRY):
+    """
+    Return the data version of a country, which changes whenever a refresh changes its stations. 0 if it was never refreshed.
+    """
+    state = get_refresh_state(country)
+    return 0 if state is None else state["version"]
+
+
+def summary_row(position: int, station):
+    """
+    Convert a combined ExistingStation into a station_summary row.
+    """
+    return {
+        "position": position, "station": station.station, "name": station.station_name, "opening_date": station.opening_date,
+        "geo_latitude": station.geo_latitude, "geo_longitude": station.geo_longitude,
+        "types": json.dumps(station.station_types, ensure_ascii=False),
+        "connecting_lines": json.dumps(station.connecting_lines, ensure_ascii=False),
+        "transport_networks": json.dumps(station.transport_networks, ensure_ascii=False),
+        "description": station.description,
+    }
+
+
+def rebuild_summary(session):
+    """
+    Rebuild station_summary from the stored stations. The stations are combined by name with parse_stations and stored
+    with their description, so readers get the combined stations without reading and grouping every row again.
+    """
+    with instrumentation.stage("summary") as record:
+        session.execute(delete(StationSummary))
+        stations = parse_stations(session.execute(select(Station.__table__).order_by(*STATION_ORDER)))
+        for chunk in chunked(enumerate(stations), BATCH_SIZE):
+            session.execute(insert(StationSummary.__table__), [summary_row(position, station) for position, station in chunk])
+        record["stations"] = len(stations)
+
+
+def update_summary(session, names):
+    """
+    Rebuild the station_summary rows of the given station names only, so a refresh that changed a few entities
+    does not rewrite the whole summary. The rows of each name are combined again from the stored stations,
+    like rebuild_summary does, and appended after the existing rows.
+    """
+    with instrumentation.stage("summary", names=len(names)) as record:
+        last = session.execute(select(func.max(StationSummary.position))).scalar()
+        stations = []
+        for chunk in chunked(names, BATCH_SIZE):
+            session.execute(delete(StationSummary).where(StationSummary.name.in_(chunk)))
+            stations += parse_stations(session.execute(select(Station.__table__).where(Station.name.in_(chunk)).order_by(*STATION_ORDER)))
+        start = 0 if last is None else last + 1
+        for chunk in chunked(enumerate(stations, start), BATCH_SIZE):
+            session.execute(insert(StationSummary.__table__), [summary_row(position, station) for position, station in chunk])
+        record["stations"] = len(stations)
+
+
+def iter_summary_rows(country: str = DEFAULT_COUNTRY):
+    """
+    Yield the station_summary rows of a country in their original order, as plain SQL result rows.
+    """
+    with get_engine(country).connect() as connection:
+        yield from connection.execute(select(StationSummary.__table__).order_by(StationSummary.position))
+
+
+def chunked(iterable, size):
+    """
+    Split an iterable into lists of at most ``size`` items without materializing the whole iterable.
+    """
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def station_rows(stations):
+    """
+    Convert Station objects (or plain dicts) into flat rows with the Station columns.
+    Rows without coordinates are skipped, as every stored station needs a position.
+    """
+    for station in stations:
+        row = station.convert_to_dict() if isinstance(station, Station) else station
+        if row["geo_latitude"] is None or row["geo_longitude"] is None:
+            continue
+        yield row
+
+
+def representative_order(entity):
+    """
+    Return the sort key that picks the stored name, code, address, date and position of an entity whose rows disagree.
+    The smallest row wins, with missing values sorted last, so the choice does not depend on the order of the rows.
+    """
+    return tuple((entity[column] is None, entity[column]) for column in ENTITY_COLUMNS)
+
+
+def write_rows(session, rows):
+    """
+    Write a batch of flat Station rows into the normalized tables with one executemany statement per table.
+    If the rows of an entity disagree on its name, code, address, date or position, the row that sorts first by
+    representative_order is stored, also when the rows are spread over several batches. The other rows only add
+    types, lines and networks. Values that are already stored are ignored.
+    """
+    entities = {}
+    for row in rows:
+        entity = {column: row[column] for column in ENTITY_COLUMNS}
+        current = entities.get(entity["station"])
+        if current is None or representative_order(entity) < representative_order(current):
+            entities[entity["station"]] = entity
+    for chunk in chunked(list(entities), BATCH_SIZE):
+        for stored in session.execute(select(StationEntity.__table__).where(StationEntity.station.in_(chunk))):
+            if representative_order(stored._mapping) <= representative_order(entities[stored.station]):
+                del entities[stored.station]
+    if entities:
+        statement = insert(StationEntity.__table__)
+        session.execute(statement.on_conflict_do_update(
+            index_elements=["station"], set_={column: statement.excluded[column] for column in ENTITY_COLUMNS if column != "station"}),
+            list(entities.values()))
+    for column, table in MULTI_VALUED.items():
+        values = {(row["station"], row[column]) for row in rows if row[column] is not None}
+        if values:
+            session.execute(insert(table.__table__).on_conflict_do_nothing(),
+                            [{"station": station, column: value} for station, value in values])
+
+
+def replace_stations(stations, batch_size: int = BATCH_SIZE, on_batch=None, country: str = DEFAULT_COUNTRY):
+    """
+    Replace all stored stations of a country with the given stations in a single transaction.
+    Rows are written with batched executemany statements, and duplicates are ignored.
+    If on_batch raises, the transaction is rolled back and the previous contents are kept.
+    The delete, the writes and the whole transaction are recorded as the "db_clear", "db_write" and "db_transaction" stages.
+
+    Args:
+        stations (iterable): Station objects or dicts with the Station columns.
+        batch_size (int, optional): Number of rows per executemany batch. Defaults to BATCH_SIZE.
+        on_batch (callable, optional): Called with the list of rows after each batch is written. Defaults to None.
+        country (str, optional): The country the stations belong to. Defaults to DEFAULT_COUNTRY.
+    """
+    write = instrumentation.Timer("db_write", country=country)
+    rows = 0
+    with instrumentation.stage("db_transaction", country=country, mode="replace"), \
+            Session(get_engine(country)) as session, session.begin():
+        with instrumentation.stage("db_clear", country=country):
+            delete_stations(session)
+        for chunk in chunked(station_rows(stations), batch_size):
+            with write:
+                write_rows(session, chunk)
+            rows += len(chunk)
+            if on_batch is not None:
+                on_batch(chunk)
+        record_refresh(session, country, "replace")
+    write.emit(rows=rows)
+
+
+def fingerprint(entity, values):
+    """
+    Compute an order independent fingerprint of a station entity and its types, lines and networks.
+
+    Args:
+        entity (dict): The StationEntity columns.
+        values (dict): Maps each multi-valued column to the set of its values.
+    """
+    canonical = ([repr(entity[column]) for column in ENTITY_COLUMNS], [sorted(values[column]) for column in MULTI_VALUED])
+    return hashlib.sha1(repr(canonical).encode("utf-8")).hexdigest()
+
+
+def rows_fingerprint(rows):
+    """
+    Compute the fingerprint the given flat rows of one station entity will have once they are written.
+    """
+    return fingerprint(min(rows, key=representative_order), {column: {row[column] for row in rows if row[column] is not None} for column in MULTI_VALUED})
+
+
+def stored_fingerprints(session):
+    """
+    Compute the fingerprint of every stored station entity.
+
+    Returns:
+        dict: Maps the station entity URI to its fingerprint.
+    """
+    entities = {row.station: dict(row._mapping) for row in session.execute(select(StationEntity.__table__))}
+    values = {station: {column: set() for column in MULTI_VALUED} for station in entities}
+    for column, table in MULTI_VALUED.items():
+        for station, value in session.execute(select(table.__table__)):
+            values[station][column].add(value)
+    return {station: fingerprint(entity, values[station]) for station, entity in entities.items()}
+
+
+def entity_names(session, keys, batch_size: int = BATCH_SIZE):
+    """
+    Return the names of the stored station entities with the given keys.
+    """
+    names = set()
+    for chunk in chunked(keys, batch_size):
+        names.update(session.execute(select(StationEntity.name).where(StationEntity.station.in_(chunk))).scalars())
+    return names
+
+
+def stage_rows(session, stations, batch_size: int = BATCH_SIZE):
+    """
+    Copy flat Station rows into a temporary table of the session's connection, in batches.
+    The table has the Station columns. It is dropped at the end of a refresh, and with the transaction if it is rolled back.
+
+    Returns:
+        Table: The temporary table.
+    """
+    table = Table(INCOMING_TABLE, MetaData(), *[Column(column.name, column.type) for column in Station.__table__.columns],
+                  prefixes=["TEMPORARY"])
+    table.drop(session.connection(), checkfirst=True)
+    table.create(session.connection())
+    for chunk in chunked(station_rows(stations), batch_size):
+        session.execute(insert(table), chunk)
+    return table
+
+
+def iter_entities(session, table, batch_size: int = BATCH_SIZE):
+    """
+    Yield the station entity URI and the list of flat rows of every entity in a staged table, one entity at a time.
+    """
+    result = session.connection().execution_options(yield_per=batch_size).execute(select(table).order_by(table.c.station))
+    for station, rows in groupby(result.mappings(), key=lambda row: row["station"]):
+        yield station, [dict(row) for row in rows]
+
+
+def entity_chunks(entities, size):
+    """
+    Join the row lists of consecutive entities into lists of about ``size`` rows, without splitting an entity.
+    """
+    chunk = []
+    for entity_rows in entities:
+        chunk.extend(entity_rows)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def refresh_stations(stations, batch_size: int = BATCH_SIZE, on_batch=None, country: str = DEFAULT_COUNTRY):
+    """
+    Incrementally refresh the stored stations of a country in a single transaction.
+    The incoming rows are copied into a temporary table and read back ordered by station entity, so only the rows of one
+    entity are held in memory at a time, next to the fingerprints of the stored entities and the keys of the changed ones.
+    Each entity is fingerprinted, and only entities whose fingerprint differs from the stored one are written.
+    Entities that are no longer present are deleted.
+    The comparison, the deletes, the writes and the whole transaction are recorded as the "db_diff", "db_clear",
+    "db_write" and "db_transaction" stages.
+
+    Args:
+        stations (iterable): Station objects or dicts with the Station columns.
+        batch_size (int, optional): Number of rows or keys per batched statement. Defaults to BATCH_SIZE.
+        on_batch (callable, optional): Called with the list of rows after each batch is written. Defaults to None.
+        country (str, optional): The country the stations belong to. Defaults to DEFAULT_COUNTRY.
+
+    Returns:
+        dict: The number of inserted, updated, deleted and unchanged station entities.
+    """
+    write = instrumentation.Timer("db_write", country=country)
+    rows = 0
+    with instrumentation.stage("db_transaction", country=country, mode="incremental"), \
+            Session(get_engine(country)) as session, session.begin():
+        with instrumentation.stage("db_diff", country=country) as record:
+            incoming = stage_rows(session, stations, batch_size)
+            stored = stored_fingerprints(session)
+            inserted, updated, names, seen = set(), set(), set(), 0
+            for key, entity_rows in iter_entities(session, incoming, batch_size):
+                seen += 1
+                if key not in stored:
+                    inserted.add(key)
+                elif rows_fingerprint(entity_rows) != stored.pop(key):
+                    updated.add(key)
+                else:
+                    continue
+                names.update(row["name"] for row in entity_rows)
+            deleted = stored.keys()
+            record["stations"] = seen
+        with instrumentation.stage("db_clear", country=country, stations=len(deleted | updated)):
+            names |= entity_names(session, deleted | updated, batch_size)
+            for chunk in chunked(deleted | updated, batch_size):
+                delete_stations(session, chunk)
+        changed = (entity_rows for key, entity_rows in iter_entities(session, incoming, batch_size) if key in inserted or key in updated)
+        for chunk in entity_chunks(changed, batch_size):
+            with write:
+                write_rows(session, chunk)
+            rows += len(chunk)
+            if on_batch is not None:
+                on_batch(chunk)
+        incoming.drop(session.connection())
+        record_refresh(session, country, "incremental", changed=bool(inserted or updated or deleted), names=names)
+    write.emit(rows=rows)
+    return {
+        "inserted": len(inserted),
+        "updated": len(updated),
+        "deleted": len(deleted),
+        "unchanged": seen - len(inserted) - len(updated),
+    }
+
+
+def migrate(engine):
+    """
+    Migrate a database created before the normalized schema. The rows of the legacy Station table are written
+    into the normalized tables, and the table is replaced by a view with the same name and columns.
+    Databases created before the data version and station_summary get the version column and their summary built.
+    Running it on an already migrated database does nothing.
+    """
+    with Session(engine) as session, session.begin():
+        kind = session.execute(text("SELECT type FROM sqlite_master WHERE name = 'Station'")).scalar()
+        if kind == "table":
+            rows = [dict(row._mapping) for row in session.execute(select(Station.__table__))]
+            for chunk in chunked(station_rows(rows), BATCH_SIZE):
+                write_rows(session, chunk)
+            session.execute(text('DROP TABLE "Station"'))
+        if kind != "view":
+            session.execute(text(STATION_VIEW))
+        columns = [row.name for row in session.execute(text("PRAGMA table_info(refresh_state)"))]
+        if "version" not in columns:
+            session.execute(text("ALTER TABLE refresh_state ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+        session.execute(text("CREATE INDEX IF NOT EXISTS ix_station_summary_name ON station_summary (name)"))
+        if session.execute(select(StationSummary.position).limit(1)).first() is None \
+                and session.execute(select(StationEntity.station).limit(1)).first() is not None:
+            rebuild_summary(session)
+
+
+def create_record(record, country: str = DEFAULT_COUNTRY):
+    """
+    Store a single Station in the normalized tables. Station is a view, so the record is written as a flat row like a batch.
+    """
+    with Session(get_engine(country)) as session:
+        write_rows(session, list(station_rows([record])))
         session.commit()
 
 
 def create_test_data():
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         new_items = []
         new_items.append(Station(
             station="DEF456",
@@ -55,15 +471,31 @@ def create_test_data():
             geo_latitude=34.0522,
             geo_longitude=-118.2437
         ))
-        session.add_all(new_items)
+        write_rows(session, list(station_rows(new_items)))
         session.commit()
         print("Test data created successfully")
 
 
-if __name__ == "__main__":  # executed when file is executed directly
-    engine = create_engine(Database, echo=False, future=True)
-    Base.metadata.create_all(engine)
+def create_schema(engine):
+    Base.metadata.create_all(engine, tables=NORMALIZED_TABLES + [RefreshState.__table__, StationSummary.__table__])
+    migrate(engine)
+
+
+def get_engine(country: str = DEFAULT_COUNTRY):
+    """
+    Return the database engine of a country. The engine is created, and the schema created or migrated, on first use,
+    so importing this module does not touch the database, and a country is only opened when it is used.
+    """
+    with engine_lock:
+        if country not in engines:
+            engine = create_engine(f"sqlite:///{database_path(country)}", echo=False, future=True)
+            create_schema(engine)
+            engines[country] = engine
+    return engines[country]
 
-else:
-    engine = create_engine(Database, echo=False, future=True)
-    Base.metadata.create_all(engine)
+
+engines = {}
+engine_lock = threading.Lock()
+
+if __name__ == "__main__":  # executed when file is executed directly
+    get_engine()
@@ -0,0 +1,3 @@
+from core import RefreshCancelled, stop_on_cancel
+from .worker import RefreshWorker
+from .markers import MarkerRegistry, ViewportRenderer, Cluster, cluster_stations
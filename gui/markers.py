@@ -0,0 +1,281 @@
+import math
+import instrumentation
+from stations.spatial import GridIndex
+
+TILE_SIZE = 256
+CLUSTER_BELOW_ZOOM = 13
+CLUSTER_CELL_PIXELS = 60
+MAX_MARKERS = 200
+VIEWPORT_MARGIN = 0.1
+CLUSTER_MARKER_OPTIONS = {"marker_color_circle": "#1E3F9B", "marker_color_outside": "#2D62C5", "text_color": "#1E3F9B"}
+
+
+def to_pixels(latitude: float, longitude: float, zoom: int):
+    """
+    This function converts a position to Web Mercator pixel coordinates at a zoom level, as used by the map tiles.
+
+    Returns:
+        tuple: The x and y pixel coordinates of the position on the whole map.
+    """
+    scale = TILE_SIZE * 2 ** zoom
+    x = (longitude + 180) / 360 * scale
+    y = (1 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2 * scale
+    return x, y
+
+
+class Cluster:
+    """
+    The Cluster class represents a group of nearby stations drawn as a single marker with a count.
+
+    Attributes:
+        station (str): The identifier of the cluster, unique per zoom level and grid cell.
+        stations (list): The stations in the cluster.
+        geo_latitude (float): The mean latitude of the stations.
+        geo_longitude (float): The mean longitude of the stations.
+        description (str): The number of stations in the cluster.
+        marker_options (dict): Extra options for the marker of the cluster.
+    """
+
+    def __init__(self, key: str, stations: list):
+        self.station = key
+        self.stations = stations
+        self.geo_latitude = sum(station.geo_latitude for station in stations) / len(stations)
+        self.geo_longitude = sum(station.geo_longitude for station in stations) / len(stations)
+        self.description = f"{len(stations)} stations"
+        self.marker_options = CLUSTER_MARKER_OPTIONS
+
+
+def cluster_stations(stations, zoom: int, cell_pixels: int = CLUSTER_CELL_PIXELS):
+    """
+    This function groups stations that fall into the same square of cell_pixels pixels on the map at a zoom level.
+    Squares with a single station keep the station itself, squares with more stations become a Cluster.
+
+    Args:
+        stations (iterable): Objects with station, geo_latitude and geo_longitude attributes.
+        zoom (int): The zoom level of the map.
+        cell_pixels (int, optional): The size of a square in pixels. Defaults to CLUSTER_CELL_PIXELS.
+
+    Returns:
+        list: The stations and clusters to draw.
+    """
+    cells = {}
+    for station in stations:
+        x, y = to_pixels(station.geo_latitude, station.geo_longitude, zoom)
+        cells.setdefault((int(x // cell_pixels), int(y // cell_pixels)), []).append(station)
+    return [members[0] if len(members) == 1 else Cluster(f"cluster:{zoom}:{cell[0]}:{cell[1]}", members)
+            for cell, members in cells.items()]
+
+
+class MarkerRegistry:
+    """
+    The MarkerRegistry class keeps track of the markers on a map widget, keyed by station identifier.
+    Every time the shown stations change, it computes which markers to add, remove and update with set operations,
+    so the work done on the canvas is proportional to what changed, not to the number of stations.
+
+    Attributes:
+        map_widget (TkinterMapView): The map the markers are drawn on.
+        markers (dict): Maps a station identifier to its marker.
+    """
+
+    def __init__(self, map_widget):
+        """
+        The constructor for MarkerRegistry class.
+
+        Args:
+            map_widget (TkinterMapView): The map the markers are drawn on.
+        """
+        self.map_widget = map_widget
+        self.markers = {}
+
+    def __len__(self):
+        return len(self.markers)
+
+    def sync(self, stations):
+        """
+        This method makes the markers on the map match the given stations.
+        Markers of stations that are no longer shown are removed, markers of stations whose position or description
+        changed are updated in place, and markers are added for new stations.
+
+        Args:
+            stations (iterable): ExistingStation objects, or any objects with station, geo_latitude, geo_longitude and description attributes.
+
+        Returns:
+            dict: The number of added, removed and updated markers.
+        """
+        wanted = {station.station: station for station in stations}
+        removed = self.markers.keys() - wanted.keys()
+        self.remove(removed)
+        counts = self.add(wanted.values())
+        counts["removed"] = len(removed)
+        return counts
+
+    def add(self, stations):
+        """
+        This method adds markers for new stations and updates the markers of known stations, without removing any markers.
+
+        Args:
+            stations (iterable): ExistingStation objects, or any objects with station, geo_latitude, geo_longitude and description attributes.
+
+        Returns:
+            dict: The number of added and updated markers.
+        """
+        added, updated = 0, 0
+        for station in stations:
+            position = (station.geo_latitude, station.geo_longitude)
+            marker = self.markers.get(station.station)
+            if marker is None:
+                self.markers[station.station] = self.map_widget.set_marker(
+                    *position, station.description, **getattr(station, "marker_options", {}))
+                added += 1
+            elif marker.position != position or marker.text != station.description:
+                if marker.position != position:
+                    marker.set_position(*position)
+                if marker.text != station.description:
+                    marker.set_text(station.description)
+                updated += 1
+        return {"added": added, "updated": updated}
+
+    def remove(self, keys):
+        """
+        This method removes the markers of the given stations in one batch.
+        It does the same as deleting each marker through the map widget, but rebuilds the marker list of the map
+        once and updates the canvas once, instead of once per marker.
+
+        Args:
+            keys (iterable): The identifiers of the stations whose markers are removed.
+        """
+        markers = {self.markers.pop(key) for key in keys if key in self.markers}
+        if not markers:
+            return
+        canvas = self.map_widget.canvas
+        self.map_widget.canvas_marker_list[:] = [marker for marker in self.map_widget.canvas_marker_list if marker not in markers]
+        for marker in markers:
+            for item in (marker.polygon, marker.big_circle, marker.canvas_text, marker.canvas_icon, marker.canvas_image):
+                if item is not None:
+                    canvas.delete(item)
+            marker.polygon, marker.big_circle, marker.canvas_text, marker.canvas_image, marker.canvas_icon = None, None, None, None, None
+            marker.deleted = True
+        canvas.update_idletasks()
+
+    def clear(self):
+        """
+        This method removes all markers of the registry from the map.
+        """
+        self.remove(list(self.markers))
+
+
+class ViewportRenderer:
+    """
+    The ViewportRenderer class draws only the stations inside the visible part of the map.
+    The stations are kept in a GridIndex, so finding the visible ones does not scan every station. Below a zoom level,
+    or when too many stations are visible, nearby stations are drawn as clusters with a count. This keeps the number of
+    canvas items bounded regardless of the number of stations. The view is checked periodically, and after a pan or zoom
+    only the markers that changed are redrawn, through a MarkerRegistry.
+
+    Attributes:
+        map_widget (TkinterMapView): The map the markers are drawn on.
+        registry (MarkerRegistry): The markers currently on the map.
+        stations (dict): Maps a station identifier to a station that can be shown.
+        index (GridIndex): The stations that can be shown.
+        view (tuple): The zoom level and bounding box of the last render.
+    """
+
+    def __init__(self, map_widget, cluster_below_zoom: int = CLUSTER_BELOW_ZOOM, max_markers: int = MAX_MARKERS):
+        """
+        The constructor for ViewportRenderer class.
+
+        Args:
+            map_widget (TkinterMapView): The map the markers are drawn on.
+            cluster_below_zoom (int, optional): Stations are clustered below this zoom level. Defaults to CLUSTER_BELOW_ZOOM.
+            max_markers (int, optional): Stations are clustered if more than this many are visible. Defaults to MAX_MARKERS.
+        """
+        self.map_widget = map_widget
+        self.cluster_below_zoom = cluster_below_zoom
+        self.max_markers = max_markers
+        self.registry = MarkerRegistry(map_widget)
+        self.stations = {}
+        self.index = GridIndex()
+        self.view = None
+
+    def set_stations(self, stations):
+        """
+        This method replaces the stations that can be shown and redraws the map.
+
+        Args:
+            stations (iterable): ExistingStation objects, or any objects with station, geo_latitude, geo_longitude and description attributes.
+        """
+        self.stations = {station.station: station for station in stations}
+        self.index = GridIndex(self.stations.values())
+        self.render(force=True)
+
+    def add_stations(self, stations):
+        """
+        This method adds stations that can be shown, replacing known stations with the same identifier, and redraws the map.
+        New stations are added to the GridIndex and replaced stations are swapped in place, so a batch costs time
+        proportional to its size. The index is only rebuilt if a known station moved.
+
+        Args:
+            stations (iterable): ExistingStation objects, or any objects with station, geo_latitude, geo_longitude and description attributes.
+        """
+        moved = False
+        for station in stations:
+            known = self.stations.get(station.station)
+            self.stations[station.station] = station
+            if moved:
+                continue
+            if known is None:
+                self.index.add((station,))
+            elif (known.geo_latitude, known.geo_longitude) == (station.geo_latitude, station.geo_longitude):
+                self.index.replace(known, station)
+            else:
+                moved = True
+        if moved:
+            self.index = GridIndex(self.stations.values())
+        self.render(force=True)
+
+    def current_view(self):
+        """
+        This method returns the zoom level and the visible bounding box of the map, widened by VIEWPORT_MARGIN on each side.
+
+        Returns:
+            tuple: The zoom level, south, west, north and east of the view.
+        """
+        zoom = round(self.map_widget.zoom)
+        north, west = self.map_widget.convert_canvas_coords_to_decimal_coords(0, 0)
+        south, east = self.map_widget.convert_canvas_coords_to_decimal_coords(self.map_widget.width, self.map_widget.height)
+        margin_latitude, margin_longitude = (north - south) * VIEWPORT_MARGIN, (east - west) * VIEWPORT_MARGIN
+        return zoom, south - margin_latitude, west - margin_longitude, north + margin_latitude, east + margin_longitude
+
+    def render(self, force: bool = False):
+        """
+        This method draws the visible stations, unless the view has not changed since the last render.
+
+        Args:
+            force (bool, optional): A flag to redraw even if the view has not changed. Defaults to False.
+
+        Returns:
+            dict: The number of added, removed and updated markers, or None if nothing was redrawn.
+        """
+        view = self.current_view()
+        if view == self.view and not force:
+            return None
+        self.view = view
+        zoom, south, west, north, east = view
+        with instrumentation.stage("render", zoom=zoom) as record:
+            visible = self.index.within_bbox(south, west, north, east)
+            record["visible"] = len(visible)
+            if zoom < self.cluster_below_zoom or len(visible) > self.max_markers:
+                visible = cluster_stations(visible, zoom)
+            counts = self.registry.sync(visible)
+            record.update(counts, markers=len(self.registry))
+        return counts
+
+    def watch(self, interval: int = 150):
+        """
+        This method redraws the map whenever it has been panned or zoomed, by checking the view every interval milliseconds.
+
+        Args:
+            interval (int, optional): The time between checks in milliseconds. Defaults to 150.
+        """
+        self.render()
+        self.map_widget.after(interval, self.watch, interval)
@@ -0,0 +1,86 @@
+import queue
+import threading
+from core import RefreshCancelled
+
+
+class RefreshWorker:
+    """
+    The RefreshWorker class runs a database refresh on a background thread, so the Tk mainloop stays responsive.
+    The worker never touches Tk itself. It reports back through a thread-safe queue that the GUI drains with root.after.
+
+    Messages are tuples of a kind and a payload:
+        ("batch", rows): A batch of station rows was written.
+        ("done", result): The job finished and returned result.
+        ("cancelled", committed): The job was cancelled and rolled back. committed lists the countries that were
+            already updated before the cancel.
+        ("error", exception): The job failed.
+
+    Attributes:
+        job (callable): The refresh job. It is called with the on_batch callback and the cancel event.
+        messages (queue.Queue): The queue of messages for the GUI.
+        cancel_event (threading.Event): Set when the job should stop at the next page, retry or batch.
+    """
+
+    def __init__(self, job):
+        """
+        The constructor for RefreshWorker class.
+
+        Args:
+            job (callable): The refresh job, called as job(on_batch=..., cancel=...).
+        """
+        self.job = job
+        self.messages = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """
+        This method starts the job on a daemon thread.
+        """
+        self.thread = threading.Thread(target=self.__run, name="refresh-worker", daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        """
+        This method asks the job to stop. The job stops at the next page or retry of the download, or at the next batch
+        boundary while writing, and rolls back its transaction.
+        """
+        self.cancel_event.set()
+
+    def is_running(self):
+        """
+        This method checks whether the job is still running.
+
+        Returns:
+            bool: True if the worker thread is alive.
+        """
+        return self.thread is not None and self.thread.is_alive()
+
+    def poll(self):
+        """
+        This method returns all messages that are currently queued without blocking. It is meant to be called from the Tk thread.
+
+        Returns:
+            list: A list of (kind, payload) tuples.
+        """
+        messages = []
+        while True:
+            try:
+                messages.append(self.messages.get_nowait())
+            except queue.Empty:
+                return messages
+
+    def __on_batch(self, rows):
+        if self.cancel_event.is_set():
+            raise RefreshCancelled()
+        self.messages.put(("batch", rows))
+
+    def __run(self):
+        try:
+            result = self.job(on_batch=self.__on_batch, cancel=self.cancel_event)
+        except RefreshCancelled as error:
+            self.messages.put(("cancelled", error.committed))
+        except Exception as error:
+            self.messages.put(("error", error))
+        else:
+            self.messages.put(("done", result))
@@ -0,0 +1,163 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import threading
+from contextlib import contextmanager
+
+METRICS_ENVIRONMENT = "STATIONS_METRICS"
+PROFILE_ENVIRONMENT = "STATIONS_PROFILE"
+
+metrics_path = os.environ.get(METRICS_ENVIRONMENT)
+profile_directory = os.environ.get(PROFILE_ENVIRONMENT)
+sink = None
+sink_lock = threading.Lock()
+profiling = threading.local()
+
+
+def configure(metrics: str = None, profile: str = None):
+    """
+    This function turns the metrics and the profiler on or off. By default they are configured from the
+    STATIONS_METRICS and STATIONS_PROFILE environment variables.
+
+    Args:
+        metrics (str, optional): The JSON lines file the events are appended to, or "-" for standard error. Defaults to None, which turns the metrics off.
+        profile (str, optional): The directory the cProfile statistics are written to. Defaults to None, which turns the profiler off.
+    """
+    global metrics_path, profile_directory, sink
+    with sink_lock:
+        if sink is not None and sink is not sys.stderr:
+            sink.close()
+        sink = None
+        metrics_path = metrics
+        profile_directory = profile
+
+
+def enabled():
+    """
+    This function checks whether events are recorded.
+    """
+    return metrics_path is not None
+
+
+def emit(event: str, **fields):
+    """
+    This function writes an event as one JSON object per line, with the time, the process and the thread.
+    Nothing is done if the metrics are off.
+
+    Args:
+        event (str): The kind of event, for example "stage".
+        **fields: The values of the event. Values that are not JSON types are written as strings.
+    """
+    global sink
+    if metrics_path is None:
+        return
+    record = {"time": round(time.time(), 6), "event": event, "pid": os.getpid(), "thread": threading.current_thread().name, **fields}
+    line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    with sink_lock:
+        if sink is None:
+            sink = sys.stderr if metrics_path == "-" else open(metrics_path, "a", encoding="utf-8")
+        sink.write(line)
+        sink.flush()
+
+
+def warn(message: str, **fields):
+    """
+    This function writes a warning to standard error and records it as a "warning" event.
+    """
+    print(message, file=sys.stderr)
+    emit("warning", message=message, **fields)
+
+
+@contextmanager
+def stage(name: str, **fields):
+    """
+    This function times the body of a with statement and records it as a "stage" event.
+    The with statement gets a dict, in which the body can store counters that are recorded with the event.
+
+    Args:
+        name (str): The name of the stage, for example "select".
+        **fields: Values recorded with the event.
+
+    Yields:
+        dict: The fields of the event.
+    """
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        emit("stage", stage=name, seconds=round(time.perf_counter() - start, 6), **fields)
+
+
+class Timer:
+    """
+    The Timer class adds up the time of many short sections of one stage, such as parsing every row of a stream,
+    and records the total as a single "stage" event.
+
+    Attributes:
+        name (str): The name of the stage.
+        seconds (float): The time spent in the sections so far.
+        fields (dict): Values recorded with the event.
+    """
+    __slots__ = ("name", "seconds", "fields", "start")
+
+    def __init__(self, name: str, **fields):
+        self.name = name
+        self.seconds = 0.0
+        self.fields = fields
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        self.seconds += time.perf_counter() - self.start
+
+    def emit(self, **fields):
+        """
+        This method records the total time of the stage, with the given counters.
+        """
+        emit("stage", stage=self.name, seconds=round(self.seconds, 6), **self.fields, **fields)
+
+
+def timed(iterable, timer: Timer):
+    """
+    This function passes the items of an iterable through, adding the time spent producing them to a Timer.
+    The time spent by the consumer of the items is not counted.
+    """
+    iterator = iter(iterable)
+    while True:
+        with timer:
+            item = next(iterator, StopIteration)
+        if item is StopIteration:
+            return
+        yield item
+
+
+@contextmanager
+def profiled(name: str):
+    """
+    This function runs the body of a with statement under cProfile if a profile directory is configured, and writes
+    the statistics to <directory>/<name>-<time>.prof, which can be read with pstats or snakeviz.
+    Nested profiled sections in the same thread are part of the outer profile.
+
+    Args:
+        name (str): The name of the profiled section.
+    """
+    if profile_directory is None or getattr(profiling, "active", False):
+        yield
+        return
+    os.makedirs(profile_directory, exist_ok=True)
+    path = os.path.join(profile_directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof")
+    profiler = cProfile.Profile()
+    profiling.active = True
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiling.active = False
+        profiler.dump_stats(path)
+        emit("profile", name=name, path=path)
@@ -1,276 +1,228 @@
-import re
 import tkinter as tk
 from tkinter import ttk
-import tkintermapview
-from api.wikidata import parse_wikidata, get_results
-from database import sql
+import core
+from countries import COUNTRIES, ALL_COUNTRIES, DEFAULT_COUNTRY, resolve_countries
 from database.data import Station
+from gui import RefreshWorker, ViewportRenderer
+from stations import filter_stations, parse_stations
 
 
-class ExistingStation:
+def update_database(refresh_markers: bool = False, incremental: bool = False, offline: bool = False, snapshot_ttl: float = None,
+                    on_batch=None, cancel=None, countries=None):
     """
-    The ExistingStation class represents a station with various attributes.
-
-    Attributes:
-        station (str): The station identifier.
-        station_name (str): The name of the station.
-        station_types (list): The types of the station.
-        connecting_lines (list): The connecting lines of the station.
-        transport_networks (list): The transport networks of the station.
-        opening_date (str): The opening date of the station.
-        geo_latitude (float): The geographical latitude of the station.
-        geo_longitude (float): The geographical longitude of the station.
-        description (str): The description of the station.
-    """
-    station = str
-    station_name = str
-    station_types = list
-    connecting_lines = list
-    transport_networks = list
-    opening_date = str
-    geo_latitude = float
-    geo_longitude = float
-    description = str
-
-    def __init__(self, station, station_name, opening_date: str, geo_latitude: float, geo_longitude: float, station_type: str = None,
-             connecting_line: str = None, transport_network: str = None):
-        """
-        The constructor for ExistingStation class.
-
-        Args:
-            station (str): The station identifier.
-            station_name (str): The name of the station.
-            opening_date (str): The opening date of the station.
-            geo_latitude (float): The geographical latitude of the station.
-            geo_longitude (float): The geographical longitude of the station.
-            station_type (str, optional): The type of the station. Defaults to None.
-            connecting_line (str, optional): The connecting line of the station. Defaults to None.
-            transport_network (str, optional): The transport network of the station. Defaults to None.
-        """
-        self.station = station
-        self.station_name = station_name
-        self.opening_date = opening_date
-        self.geo_latitude = geo_latitude
-        self.geo_longitude = geo_longitude
-        self.station_types = []
-        self.connecting_lines = []
-        self.transport_networks = []
-        if station_type is not None:
-            self.station_types.append(station_type)
-        if connecting_line is not None:
-            self.connecting_lines.append(connecting_line)
-        if transport_network is not None:
-            self.transport_networks.append(transport_network)
-        self.__update_description()
-
-    def __repr__(self):
-        """
-        This method is used to provide a string representation of the ExistingStation object.
-        It returns a formatted string that includes all the attributes of the ExistingStation object.
-
-        Returns:
-            str: A string representation of the ExistingStation object.
-        """
-        return f"ExistingStation({self.station}, {self.station_name}, {str(self.opening_date)},{self.geo_latitude}, {self.geo_longitude}, {self.station_types}, {self.connecting_lines}, {self.transport_networks}, {self.description})"
-
-    def add_attribute(self, station_type: str = None, connecting_line: str = None, transport_network: str = None):
-        """
-        This method is used to add attributes to the ExistingStation object.
-        It checks if the station_type, connecting_line, and transport_network are not None and not already in their respective lists.
-        If they are not, it adds them to their respective lists.
-        After adding the attributes, it calls the __update_description method to update the description of the ExistingStation object.
-
-        Args:
-            station_type (str, optional): The type of the station. Defaults to None.
-            connecting_line (str, optional): The connecting line of the station. Defaults to None.
-            transport_network (str, optional): The transport network of the station. Defaults to None.
-        """
-        if station_type is not None:
-            if station_type not in self.station_types:
-                self.station_types.append(station_type)
-        if connecting_line is not None:
-            if connecting_line not in self.connecting_lines:
-                self.connecting_lines.append(connecting_line)
-        if transport_network is not None:
-            if transport_network not in self.transport_networks:
-                self.transport_networks.append(transport_network)
-        self.__update_description()
-
-    def __update_description(self):
-        """
-        This private method is used to update the description of the ExistingStation object.
-        It first checks if there are any station types, connecting lines, and transport networks.
-        If there are, it strips the brackets from their string representations and adds them to the description.
-        The description is a formatted string that includes the station name, station types, connecting lines, transport networks, and the opening date.
-        If the opening date is not available, it adds "Missing date" to the description.
-
-        Note:
-            This method is called internally whenever an attribute is added to the ExistingStation object.
-        """
-        stripped_types, stripped_lines, stripped_networks = "", "", ""
-        if len(self.station_types) > 0:
-            stripped_types = f",{str(self.station_types).strip('[]')}"
-
-        if len(self.connecting_lines) > 0:
-            stripped_lines = f", {str(self.connecting_lines).strip('[]')}"
-        if len(self.connecting_lines) > 0:
-            stripped_networks = f", {str(self.transport_networks).strip('[]')}"
-
-        self.description = f"{self.station_name} {stripped_types}{stripped_lines}{stripped_networks}{str(self.opening_date) if self.opening_date is not None else 'Missing date'}"
-
-
-def filter_stations(stations, search):
-    """
-    This function is used to filter stations based on search criteria.
-    It first checks if the search list is empty, if so, it returns all stations.
-    If the search list is not empty, it converts each search term to lowercase and iterates over them.
-    For each search term, it iterates over all stations and checks if the search term matches any attribute of the station.
-    If a match is found, the station is added to the list of filtered stations.
+    This function is used to update the database of one or more countries with new data from wikidata.
+    Every country is updated in a transaction of its own, and the other countries are left untouched.
+    It streams the results from wikidata, parses them incrementally, and replaces the existing stations in the database
+    in a single transaction, writing the parsed stations in fixed-size batches.
+    The results are read through the on-disk snapshot cache, so a recent snapshot is reused instead of querying wikidata again.
+    In incremental mode only the stations that differ from the stored data are inserted, updated or deleted.
+    If the refresh_markers argument is set to True, it will also refresh the markers on the map based on the search entry.
 
     Args:
-        stations (list): A list of Station objects.
-        search (list): A list of search criteria.
+        refresh_markers (bool, optional): A flag to determine whether to refresh the markers on the map. Defaults to False.
+        incremental (bool, optional): A flag to only write the stations that changed. Defaults to False.
+        offline (bool, optional): A flag to rebuild the database from the last snapshot without querying wikidata. Defaults to False.
+        snapshot_ttl (float, optional): The time to live of a snapshot in seconds. Defaults to the snapshot cache default.
+        on_batch (callable, optional): Called with the list of rows after each batch is written. Defaults to None.
+        cancel (threading.Event, optional): When set, the update stops and the country being updated is left unchanged.
+            The RefreshCancelled raised lists the countries that were already committed. Defaults to None.
+        countries (str or list, optional): A country code, "all", or a list of country codes. Defaults to DEFAULT_COUNTRY.
 
     Returns:
-        list: A list of filtered Station objects.
-    """
-    if len(search) == 0:
-        return stations
-    filtered_stations = []
-    filters = [x.lower() for x in search]
-    for filter in filters:
-        for station in stations:
-            print(f"station: {station.transport_network.lower() if station.transport_network is not None else 'None'}, filter: {filter}")
-            if re.search(filter, station.name.lower()):
-                filtered_stations.append(station)
-            elif station.type is not None and re.search(filter, station.type.lower()):
-                filtered_stations.append(station)
-            elif station.connecting_line is not None and re.search(filter, station.connecting_line.lower()):
-                filtered_stations.append(station)
-            elif station.transport_network is not None and re.search(filter, station.transport_network.lower()):
-                filtered_stations.append(station)
-            elif station.opening_date is not None and re.search(filter, str(station.opening_date)):
-                filtered_stations.append(station)
-    return filtered_stations
-
-
-def parse_stations(stations):
+        dict: Maps each country code to the number of inserted, updated, deleted and unchanged stations in incremental mode, otherwise to None.
+
+    Global:
+        search_entry: A global variable representing the search entry.
     """
-    This function is used to combine stations with the same name.
-    It first converts each station to a dictionary and checks if a station with the same name already exists in the list of existing stations.
-    If a station with the same name exists, it adds the attributes of the current station to the existing station.
-    If a station with the same name does not exist, it creates a new ExistingStation object and adds it to the list of existing stations.
+    counts = {}
+    for country_code in resolve_countries(countries):
+        try:
+            counts[country_code] = core.update(incremental=incremental, offline=offline, snapshot_ttl=snapshot_ttl,
+                                               on_batch=on_batch, cancel=cancel, country=country_code)
+        except core.RefreshCancelled as error:
+            error.committed = list(counts)
+            raise
+    if refresh_markers:
+        fill_coordinates(search_entry.get().split(","))
+    return counts
 
-    Args:
-        stations (list): A list of Station objects.
 
-    Returns:
-        list: A list of ExistingStation objects with unique station names.
-    """
-    existing_stations = []
-    for station in stations:
-        new_station = True
-        station = station.convert_to_dict()
-        for existing_station in existing_stations:
-            if existing_station.station_name == station["name"]:
-                existing_station.add_attribute(station["type"], station["connecting_line"],
-                                               station["transport_network"])
-                new_station = False
-                continue
-        if new_station:
-            existing_stations.append(
-                ExistingStation(station["station"], station["name"], station["opening_date"],station["geo_latitude"], station["geo_longitude"],
-                                station["type"], station["connecting_line"], station["transport_network"]))
-    return existing_stations
-
-
-def update_database(refresh_markers: bool = False):
+def show_nearest(coordinates):
     """
-    This function is used to update the database with new data from wikidata.
-    It first fetches the results from wikidata, parses the results, and then clears the existing stations in the database.
-    After that, it iterates over the parsed data and tries to create a new record for each data in the database.
-    If the refresh_markers argument is set to True, it will also refresh the markers on the map based on the search entry.
+    This function lists the stations closest to a position that was clicked on the map.
 
     Args:
-        refresh_markers (bool, optional): A flag to determine whether to refresh the markers on the map. Defaults to False.
+        coordinates (tuple): The latitude and longitude of the clicked position.
 
     Global:
-        search_entry: A global variable representing the search entry.
+        nearest_list: A global variable representing the list of nearest stations.
+        country: A global variable holding the selected country.
     """
-    wikidata = get_results()
-    parsed = parse_wikidata(wikidata)
-    sql.clear_station()
-    for data in parsed:
-        print(data)
-        try:
-            sql.create_record(data)
-        except Exception:
-            pass
-    if refresh_markers:
-        fill_coordinates(search_entry.get().split(","))
+    nearest_list.delete(0, tk.END)
+    for distance, station in core.nearest(*coordinates, k=NEAREST_COUNT, countries=country.get()):
+        nearest_list.insert(tk.END, f"{station.station_name} ({distance:.1f} km)")
 
 
 def fill_coordinates(search=None):
     """
     This function is used to load all stations from the database and display them on the map.
-    It first fetches all stations from the database, filters them based on the search criteria,
-    and then parses the stations to combine stations with the same name.
-    After that, it checks the existing markers on the map and removes any that do not correspond to a station.
-    Finally, it adds markers for all stations that do not already have a marker on the map.
+    It searches the stations based on the search criteria and combines stations with the same name.
+    Without search criteria the combined stations stored at the last update are used, and repeated searches
+    are answered from the search cache of core, so neither is recomputed until the data changes.
+    After that, the stations are handed to the map renderer, which only draws the stations in the visible part of the map,
+    clusters nearby stations when zoomed out, and only changes the markers that differ from what is already drawn.
 
     Args:
         search (list, optional): A list of search criteria. If no search criteria are provided, all stations are loaded. Defaults to None.
 
     Global:
-        map_widget: A global variable representing the map widget.
+        map_renderer: A global variable holding the renderer of the markers on the map widget.
+        match_all: A global variable holding whether all search criteria have to match.
+        country: A global variable holding the selected country.
     """
     if search is None:
         search = []
-    global map_widget
-    # map_widget.delete_all_marker()
-    stations = sql.select_all(Station)
-    stations = filter_stations(stations, search)
-    stations = parse_stations(stations)
-
-    # Check existing markers on the map
-    existing_markers = set(map_widget.canvas_marker_list)
-    for marker in existing_markers:
-        # If the marker's position does not correspond to a station, remove the marker
-        if marker.position not in [(station.geo_latitude, station.geo_longitude) for station in stations]:
-            map_widget.delete(marker)
-    # Add a marker for each station that does not already have a marker
-    for station in stations:
-        if (station.geo_latitude, station.geo_longitude) not in [marker.position for marker in existing_markers]:
-            try:
-                map_widget.set_marker(station.geo_latitude, station.geo_longitude, station.description)
-            except TypeError:
-                pass
-
-
-root = tk.Tk()
-root.geometry("900x800")
-
-my_label = tk.LabelFrame(root)
-my_label.pack(pady=20)
-
-map_widget = tkintermapview.TkinterMapView(my_label, width=800, height=600, corner_radius=0)
-map_widget.set_position(55.668308, 12.384060)
-fill_coordinates()
-map_widget.set_zoom(8)
-map_widget.pack()
-
-search_label = tk.Label(root, text="Search for station, type, line or network. Separated by comma(c line,aarhus)")
-search_label.pack()
-search_entry = ttk.Entry(root)
-search_entry.pack()
-
-submit_button = tk.Button(root, text="Search", command=lambda: fill_coordinates(search_entry.get().split(",")))
-submit_button.pack()
-
-update_button = tk.Button(root, text="Update database (may take a while.)", command=lambda: update_database(refresh_markers=True))
-update_button.pack()
+    map_renderer.set_stations(core.search_stations(search, match_all.get(), country.get()))
+
+
+def show_batch(rows):
+    """
+    This function adds markers for a batch of stations that was just written by a running update,
+    so the map fills up while the update is still in progress. Only stations matching the current search are shown.
+
+    Args:
+        rows (list): A list of station rows as dicts.
+
+    Global:
+        map_renderer: A global variable holding the renderer of the markers on the map widget.
+        search_entry: A global variable representing the search entry.
+    """
+    stations = filter_stations([Station(**row) for row in rows], search_entry.get().split(","), match_all.get())
+    map_renderer.add_stations(parse_stations(stations))
+
+
+def select_country(event=None):
+    """
+    This function shows the stations of the selected country and moves the map to it.
+
+    Global:
+        map_widget: A global variable holding the map widget.
+        country: A global variable holding the selected country.
+    """
+    if country.get() in COUNTRIES:
+        selected = COUNTRIES[country.get()]
+        map_widget.set_position(selected.latitude, selected.longitude)
+        map_widget.set_zoom(selected.zoom)
+    fill_coordinates(search_entry.get().split(","))
+
+
+def start_update():
+    """
+    This function starts an incremental database update of the selected country on a background worker, unless one is already running.
+    The Tk mainloop keeps running while the update fetches, parses and writes the stations.
+
+    Global:
+        worker: A global variable holding the running RefreshWorker.
+        country: A global variable holding the selected country.
+    """
+    global worker
+    if worker is not None and worker.is_running():
+        return
+    countries = country.get()
+    worker = RefreshWorker(lambda on_batch, cancel: update_database(incremental=True, snapshot_ttl=0, on_batch=on_batch,
+                                                                    cancel=cancel, countries=countries))
+    worker.start()
+    written = 0
+    status_label.config(text="Updating database...")
+    cancel_button.config(state=tk.NORMAL)
+
+    def poll_worker():
+        nonlocal written
+        for kind, payload in worker.poll():
+            if kind == "batch":
+                written += len(payload)
+                status_label.config(text=f"Updating database... {written} rows written")
+                show_batch(payload)
+            elif kind == "done":
+                status_label.config(text=f"Database updated: {payload}")
+                fill_coordinates(search_entry.get().split(","))
+            elif kind == "cancelled" and payload:
+                status_label.config(text=f"Update cancelled, {', '.join(payload)} were updated, the other countries were not changed")
+                fill_coordinates(search_entry.get().split(","))
+            elif kind == "cancelled":
+                status_label.config(text="Update cancelled, the database was not changed")
+                fill_coordinates(search_entry.get().split(","))
+            elif kind == "error":
+                status_label.config(text=f"Update failed: {payload}")
+        if worker.is_running() or not worker.messages.empty():
+            root.after(100, poll_worker)
+        else:
+            cancel_button.config(state=tk.DISABLED)
+
+    root.after(100, poll_worker)
+
+
+def build_gui():
+    """
+    This function creates the main window with the map, the search field and the update controls.
+    The map widget is only imported here, so the functions of this module can be imported without a display.
+
+    Global:
+        root, map_widget, map_renderer, match_all, country, search_entry, cancel_button, status_label, nearest_list:
+            Global variables holding the window and its widgets.
+    """
+    global root, map_widget, map_renderer, match_all, country, search_entry, cancel_button, status_label, nearest_list
+    import tkintermapview
+
+    root = tk.Tk()
+    root.geometry("900x1030")
+
+    my_label = tk.LabelFrame(root)
+    my_label.pack(pady=20)
+
+    map_widget = tkintermapview.TkinterMapView(my_label, width=800, height=600, corner_radius=0)
+    map_widget.set_position(55.668308, 12.384060)
+    match_all = tk.BooleanVar(root, value=False)
+    country = tk.StringVar(root, value=DEFAULT_COUNTRY)
+    map_renderer = ViewportRenderer(map_widget)
+    fill_coordinates()
+    map_widget.set_zoom(8)
+    map_widget.pack()
+    map_renderer.watch()
+    map_widget.add_left_click_map_command(show_nearest)
+
+    search_label = tk.Label(root, text="Search for station, type, line or network. Separated by comma(c line,aarhus)")
+    search_label.pack()
+    search_entry = ttk.Entry(root)
+    search_entry.pack()
+    match_all_checkbox = tk.Checkbutton(root, text="Match all search terms", variable=match_all)
+    match_all_checkbox.pack()
+    country_selector = ttk.Combobox(root, textvariable=country, values=[*COUNTRIES, ALL_COUNTRIES], state="readonly", width=6)
+    country_selector.bind("<<ComboboxSelected>>", select_country)
+    country_selector.pack()
+
+    submit_button = tk.Button(root, text="Search", command=lambda: fill_coordinates(search_entry.get().split(",")))
+    submit_button.pack()
+
+    update_button = tk.Button(root, text="Update database (may take a while.)", command=start_update)
+    update_button.pack()
+
+    cancel_button = tk.Button(root, text="Cancel update", state=tk.DISABLED, command=lambda: worker.cancel())
+    cancel_button.pack()
+
+    status_label = tk.Label(root, text="")
+    status_label.pack()
+
+    nearest_label = tk.Label(root, text="Click the map to list the closest stations")
+    nearest_label.pack()
+    nearest_list = tk.Listbox(root, height=NEAREST_COUNT, width=60)
+    nearest_list.pack()
+    return root
+
+
+NEAREST_COUNT = 5
+
+worker = None
 
 if __name__ == "__main__":
-    root.mainloop()
-else:
-    pass
+    build_gui().mainloop()
@@ -0,0 +1,4 @@
+from .search import SearchIndex, filter_stations
+from .grouping import ExistingStation, parse_stations
+from .spatial import GridIndex, KDTree, SpatialIndex, haversine
+from .model import StationTable, StationRow, Vocabulary
@@ -0,0 +1,155 @@
+class ExistingStation:
+    """
+    The ExistingStation class represents a station with various attributes.
+    The types, lines and networks are kept as insertion ordered sets (dicts without values),
+    so adding an attribute is a constant time operation, and the description is only built when it is read.
+    The attributes are declared in __slots__, so instances carry no per-instance __dict__.
+
+    Attributes:
+        station (str): The station identifier.
+        station_name (str): The name of the station.
+        station_types (list): The types of the station.
+        connecting_lines (list): The connecting lines of the station.
+        transport_networks (list): The transport networks of the station.
+        opening_date (str): The opening date of the station.
+        geo_latitude (float): The geographical latitude of the station.
+        geo_longitude (float): The geographical longitude of the station.
+        description (str): The description of the station.
+        country (str): The country code of the station, or None.
+    """
+    __slots__ = ("station", "station_name", "opening_date", "geo_latitude", "geo_longitude", "country",
+                 "_station_types", "_connecting_lines", "_transport_networks", "_description")
+
+    def __init__(self, station, station_name, opening_date: str, geo_latitude: float, geo_longitude: float, station_type: str = None,
+             connecting_line: str = None, transport_network: str = None, country: str = None):
+        """
+        The constructor for ExistingStation class.
+
+        Args:
+            station (str): The station identifier.
+            station_name (str): The name of the station.
+            opening_date (str): The opening date of the station.
+            geo_latitude (float): The geographical latitude of the station.
+            geo_longitude (float): The geographical longitude of the station.
+            station_type (str, optional): The type of the station. Defaults to None.
+            connecting_line (str, optional): The connecting line of the station. Defaults to None.
+            transport_network (str, optional): The transport network of the station. Defaults to None.
+            country (str, optional): The country code of the station. Defaults to None.
+        """
+        self.station = station
+        self.station_name = station_name
+        self.opening_date = opening_date
+        self.geo_latitude = geo_latitude
+        self.geo_longitude = geo_longitude
+        self.country = country
+        self._station_types = {}
+        self._connecting_lines = {}
+        self._transport_networks = {}
+        self._description = None
+        self.add_attribute(station_type, connecting_line, transport_network)
+
+    def __repr__(self):
+        """
+        This method is used to provide a string representation of the ExistingStation object.
+        It returns a formatted string that includes all the attributes of the ExistingStation object.
+
+        Returns:
+            str: A string representation of the ExistingStation object.
+        """
+        return f"ExistingStation({self.station}, {self.station_name}, {str(self.opening_date)},{self.geo_latitude}, {self.geo_longitude}, {self.station_types}, {self.connecting_lines}, {self.transport_networks}, {self.description})"
+
+    @classmethod
+    def from_summary(cls, station, station_name, opening_date, geo_latitude: float, geo_longitude: float, station_types: list,
+                     connecting_lines: list, transport_networks: list, description: str, country: str = None):
+        """
+        This method recreates a combined ExistingStation from its stored summary, including the description,
+        without adding the attributes one by one.
+
+        Returns:
+            ExistingStation: The combined station.
+        """
+        existing_station = cls(station, station_name, opening_date, geo_latitude, geo_longitude, country=country)
+        existing_station._station_types = dict.fromkeys(station_types)
+        existing_station._connecting_lines = dict.fromkeys(connecting_lines)
+        existing_station._transport_networks = dict.fromkeys(transport_networks)
+        existing_station._description = description
+        return existing_station
+
+    @property
+    def station_types(self):
+        return list(self._station_types)
+
+    @property
+    def connecting_lines(self):
+        return list(self._connecting_lines)
+
+    @property
+    def transport_networks(self):
+        return list(self._transport_networks)
+
+    def add_attribute(self, station_type: str = None, connecting_line: str = None, transport_network: str = None):
+        """
+        This method is used to add attributes to the ExistingStation object.
+        Attributes that are None or already known are ignored. The description is rebuilt the next time it is read.
+
+        Args:
+            station_type (str, optional): The type of the station. Defaults to None.
+            connecting_line (str, optional): The connecting line of the station. Defaults to None.
+            transport_network (str, optional): The transport network of the station. Defaults to None.
+        """
+        if station_type is not None:
+            self._station_types[station_type] = None
+        if connecting_line is not None:
+            self._connecting_lines[connecting_line] = None
+        if transport_network is not None:
+            self._transport_networks[transport_network] = None
+        self._description = None
+
+    @property
+    def description(self):
+        """
+        The description is a formatted string that includes the station name, station types, connecting lines, transport networks, and the opening date.
+        If the opening date is not available, it adds "Missing date" to the description.
+        It is built on first access after a change and cached until the next change.
+
+        Returns:
+            str: The description of the station.
+        """
+        if self._description is None:
+            stripped_types, stripped_lines, stripped_networks = "", "", ""
+            if len(self._station_types) > 0:
+                stripped_types = f",{str(self.station_types).strip('[]')}"
+
+            if len(self._connecting_lines) > 0:
+                stripped_lines = f", {str(self.connecting_lines).strip('[]')}"
+            if len(self._connecting_lines) > 0:
+                stripped_networks = f", {str(self.transport_networks).strip('[]')}"
+
+            self._description = f"{self.station_name} {stripped_types}{stripped_lines}{stripped_networks}{str(self.opening_date) if self.opening_date is not None else 'Missing date'}"
+        return self._description
+
+
+def parse_stations(stations):
+    """
+    This function is used to combine stations with the same name.
+    Stations are accumulated in a dict keyed by country and name, so each station is looked up in constant time
+    and the whole grouping runs in linear time. Stations with the same name in different countries are kept apart.
+    The order of first appearance is kept.
+
+    Args:
+        stations (iterable): Station objects or any objects with the Station attributes.
+
+    Returns:
+        list: A list of ExistingStation objects with unique station names.
+    """
+    existing_stations = {}
+    for station in stations:
+        country = getattr(station, "country", None)
+        existing_station = existing_stations.get((country, station.name))
+        if existing_station is None:
+            existing_stations[(country, station.name)] = ExistingStation(
+                station.station, station.name, station.opening_date, station.geo_latitude, station.geo_longitude,
+                station.type, station.connecting_line, station.transport_network, country)
+        else:
+            existing_station.add_attribute(station.type, station.connecting_line, station.transport_network)
+    return list(existing_stations.values())
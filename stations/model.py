@@ -0,0 +1,180 @@
+from array import array
+from collections.abc import Sequence
+from datetime import date
+from itertools import islice
+from operator import attrgetter
+
+STRING_COLUMNS = ("station", "name", "uic_code", "transport_network", "address", "type", "connecting_line")
+COLUMNS = STRING_COLUMNS + ("opening_date", "geo_latitude", "geo_longitude")
+MISSING = -1
+BATCH_SIZE = 4096
+
+
+class Vocabulary:
+    """
+    The Vocabulary class interns strings as small integer codes. Every distinct string is stored once,
+    and MISSING is the code of None.
+
+    Attributes:
+        values (list): The distinct strings, indexed by their code.
+        codes (dict): Maps a string to its code, and None to MISSING.
+    """
+    __slots__ = ("values", "codes")
+
+    def __init__(self):
+        self.values = []
+        self.codes = {None: MISSING}
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, value):
+        """
+        This method returns the code of a string, adding the string to the vocabulary if it is new.
+        """
+        if value is None:
+            return MISSING
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def encode_all(self, values):
+        """
+        This method returns the codes of a sequence of strings, adding the new strings to the vocabulary.
+        The strings are looked up without a call per value, and only the distinct new strings are added one at a time.
+        """
+        codes = self.codes
+        new = [value for value in dict.fromkeys(values) if value not in codes]
+        if new:
+            codes.update(zip(new, range(len(self.values), len(self.values) + len(new))))
+            self.values.extend(new)
+        return list(map(codes.get, values))
+
+    def decode(self, code: int):
+        """
+        This method returns the string of a code.
+        """
+        return None if code == MISSING else self.values[code]
+
+
+def string_column(column: str):
+    """
+    This function returns a property that reads a string column of a StationRow from its table.
+    """
+    def getter(self):
+        return self.table.vocabulary.decode(self.table.columns[column][self.index])
+    return property(getter)
+
+
+class StationRow:
+    """
+    The StationRow class is a read-only view of one row of a StationTable.
+    It has the same attributes and convert_to_dict method as a Station, but only holds a reference to its table and
+    its position, so it can be used wherever the search and map code reads stations.
+    """
+    __slots__ = ("table", "index")
+
+    station = string_column("station")
+    name = string_column("name")
+    uic_code = string_column("uic_code")
+    transport_network = string_column("transport_network")
+    address = string_column("address")
+    type = string_column("type")
+    connecting_line = string_column("connecting_line")
+
+    def __init__(self, table, index: int):
+        self.table = table
+        self.index = index
+
+    def __repr__(self):
+        return f"StationRow({self.convert_to_dict()})"
+
+    @property
+    def country(self):
+        return self.table.country
+
+    @property
+    def opening_date(self):
+        ordinal = self.table.opening_dates[self.index]
+        return None if ordinal == 0 else date.fromordinal(ordinal)
+
+    @property
+    def geo_latitude(self):
+        return self.table.latitudes[self.index]
+
+    @property
+    def geo_longitude(self):
+        return self.table.longitudes[self.index]
+
+    def convert_to_dict(self):
+        return {
+            "station": self.station, "name": self.name, "uic_code": self.uic_code, "transport_network": self.transport_network, "address": self.address, "type": self.type, "connecting_line": self.connecting_line, "opening_date": self.opening_date, "geo_latitude": self.geo_latitude, "geo_longitude": self.geo_longitude
+        }
+
+
+class StationTable:
+    """
+    The StationTable class is a compact, read-only, column oriented copy of the Station rows.
+    String columns are stored as integer codes into one shared Vocabulary, so every distinct type, line, network
+    or name is kept in memory once. Dates are stored as ordinals and coordinates as doubles in typed arrays.
+    Indexing or iterating the table returns lightweight StationRow views.
+
+    Attributes:
+        country (str): The country code of the stations, or None.
+        vocabulary (Vocabulary): The distinct strings of all string columns.
+        columns (dict): Maps each string column to an array of codes.
+        opening_dates (array): The opening dates as ordinals, 0 if missing.
+        latitudes (array): The latitudes.
+        longitudes (array): The longitudes.
+    """
+
+    def __init__(self, rows=(), country: str = None):
+        """
+        The constructor for StationTable class.
+
+        Args:
+            rows (iterable, optional): SQL result rows or tuples in COLUMNS order, or objects with the Station attributes. Defaults to no rows.
+            country (str, optional): The country code of the stations. Defaults to None.
+        """
+        self.country = country
+        self.vocabulary = Vocabulary()
+        self.columns = {column: array("i") for column in STRING_COLUMNS}
+        self.opening_dates = array("i")
+        self.latitudes = array("d")
+        self.longitudes = array("d")
+        self.extend(rows)
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("StationTable index out of range")
+        return StationRow(self, index)
+
+    def __iter__(self):
+        return (StationRow(self, index) for index in range(len(self)))
+
+    def extend(self, rows):
+        """
+        This method appends rows to the table. The rows are encoded in batches of BATCH_SIZE, one column at a time.
+        SQL result rows and other sequences are read by position and must have their values in COLUMNS order,
+        other objects, such as Station objects, are read by attribute.
+
+        Args:
+            rows (iterable): SQL result rows or tuples in COLUMNS order, or objects with the Station attributes.
+        """
+        rows = iter(rows)
+        while batch := list(islice(rows, BATCH_SIZE)):
+            if not isinstance(batch[0], Sequence):
+                batch = list(map(attrgetter(*COLUMNS), batch))
+            values = list(zip(*batch))
+            for column, strings in zip(STRING_COLUMNS, values):
+                self.columns[column].extend(self.vocabulary.encode_all(strings))
+            self.opening_dates.extend([0 if opening_date is None else opening_date.toordinal() for opening_date in values[7]])
+            self.latitudes.extend(values[8])
+            self.longitudes.extend(values[9])
@@ -0,0 +1,166 @@
+import re
+
+SEARCH_FIELDS = ("name", "type", "connecting_line", "transport_network", "opening_date")
+REGEX_CHARACTERS = set(".^$*+?{}[]|()\\")
+
+
+def trigrams(text: str):
+    """
+    This function returns the set of all three character substrings of a text.
+
+    Args:
+        text (str): The text to split.
+
+    Returns:
+        set: The trigrams of the text.
+    """
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    """
+    The SearchIndex class is an inverted index over the searchable fields of a list of stations.
+    It is built once per data load and answers searches without scanning every station.
+
+    Every distinct lowercase field value is mapped to the stations that have it, and a trigram index maps
+    three character substrings to the values that contain them. A search term is first matched against the
+    distinct values, and the matching values are then expanded to stations with set operations.
+
+    Attributes:
+        stations (list): The indexed stations, in their original order.
+        postings (dict): Maps a lowercase field value to the set of station positions that have it.
+        trigram_index (dict): Maps a trigram to the set of field values that contain it.
+    """
+
+    def __init__(self, stations, fields=SEARCH_FIELDS):
+        """
+        The constructor for SearchIndex class.
+
+        Args:
+            stations (iterable): The stations to index. Any object with the searched attributes can be used.
+            fields (tuple, optional): The attributes to index. Defaults to SEARCH_FIELDS.
+        """
+        self.stations = list(stations)
+        self.postings = {}
+        self.trigram_index = {}
+        for position, station in enumerate(self.stations):
+            for field in fields:
+                value = getattr(station, field)
+                if value is None:
+                    continue
+                value = str(value).lower()
+                stations_with_value = self.postings.get(value)
+                if stations_with_value is None:
+                    stations_with_value = self.postings[value] = set()
+                    for trigram in trigrams(value):
+                        self.trigram_index.setdefault(trigram, set()).add(value)
+                stations_with_value.add(position)
+
+    def __len__(self):
+        return len(self.stations)
+
+    def matching_values(self, term: str):
+        """
+        This method returns the distinct field values matching a single lowercase search term.
+        Terms containing regular expression characters are matched as regular expressions, like the search always has.
+        Plain terms of three or more characters are looked up through the trigram index, shorter terms scan the distinct values.
+
+        Args:
+            term (str): The lowercase search term.
+
+        Returns:
+            iterable: The matching field values.
+        """
+        if REGEX_CHARACTERS.intersection(term):
+            try:
+                pattern = re.compile(term)
+            except re.error:
+                pass
+            else:
+                return [value for value in self.postings if pattern.search(value)]
+        if len(term) < 3:
+            return [value for value in self.postings if term in value]
+        candidates = None
+        for trigram in sorted(trigrams(term), key=lambda trigram: len(self.trigram_index.get(trigram, ()))):
+            values = self.trigram_index.get(trigram)
+            if not values:
+                return []
+            candidates = set(values) if candidates is None else candidates & values
+        return [value for value in candidates if term in value]
+
+    def match(self, term: str):
+        """
+        This method returns the positions of all stations with a field matching a single lowercase search term.
+
+        Args:
+            term (str): The lowercase search term.
+
+        Returns:
+            set: The positions of the matching stations.
+        """
+        positions = set()
+        for value in self.matching_values(term):
+            positions |= self.postings[value]
+        return positions
+
+    def station_key(self, position: int):
+        """
+        This method returns the key of the combined station a row belongs to. Rows are combined by country and name,
+        like parse_stations does for the map.
+
+        Args:
+            position (int): The position of the row.
+
+        Returns:
+            tuple: The country and name of the row.
+        """
+        station = self.stations[position]
+        return getattr(station, "country", None), station.name
+
+    def search(self, search, match_all: bool = False):
+        """
+        This method returns the stations matching a list of search terms, without duplicates and in their original order.
+        By default a station matches if any term matches one of its fields. With match_all every term has to match
+        one of the rows combined into the same station, since a station with two types or lines has one row for each.
+        The rows of those stations matching any of the terms are returned.
+        Empty terms are ignored, and if no terms are given all stations are returned.
+
+        Args:
+            search (list): A list of search terms, for example the comma separated parts of the search field.
+            match_all (bool, optional): A flag to require all terms to match. Defaults to False.
+
+        Returns:
+            list: The matching stations.
+        """
+        terms = [term.strip().lower() for term in search if term.strip()]
+        if len(terms) == 0:
+            return list(self.stations)
+        positions, keys = set(), None
+        for term in terms:
+            matches = self.match(term)
+            positions |= matches
+            if match_all:
+                matched_keys = {self.station_key(position) for position in matches}
+                keys = matched_keys if keys is None else keys & matched_keys
+        if match_all:
+            positions = {position for position in positions if self.station_key(position) in keys}
+        return [self.stations[position] for position in sorted(positions)]
+
+
+def filter_stations(stations, search, match_all: bool = False):
+    """
+    This function is used to filter stations based on search criteria.
+    It builds a SearchIndex over the stations and searches it. When the same stations are searched repeatedly,
+    build the SearchIndex once and call its search method instead.
+
+    Args:
+        stations (list): A list of Station objects.
+        search (list): A list of search criteria.
+        match_all (bool, optional): A flag to require all search criteria to match. Defaults to False.
+
+    Returns:
+        list: A list of filtered Station objects.
+    """
+    if len(search) == 0:
+        return stations
+    return SearchIndex(stations).search(search, match_all)
@@ -0,0 +1,280 @@
+import math
+import heapq
+
+GRID_CELL_SIZE = 0.25
+EARTH_RADIUS_KM = 6371.0088
+
+
+def to_vector(latitude: float, longitude: float):
+    """
+    This function converts a position to a point on the unit sphere.
+    The straight line (chord) distance between two such points grows with the great circle distance between the positions,
+    so nearest neighbours on the sphere can be found with plain euclidean distances.
+
+    Returns:
+        tuple: The x, y and z coordinates of the point.
+    """
+    latitude, longitude = math.radians(latitude), math.radians(longitude)
+    return math.cos(latitude) * math.cos(longitude), math.cos(latitude) * math.sin(longitude), math.sin(latitude)
+
+
+def chord_to_km(chord: float):
+    """
+    This function converts a chord length on the unit sphere to a great circle distance in kilometres.
+    """
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+def km_to_chord(distance: float):
+    """
+    This function converts a great circle distance in kilometres to a chord length on the unit sphere.
+    """
+    return 2 * math.sin(min(math.pi, distance / EARTH_RADIUS_KM) / 2)
+
+
+def haversine(latitude_a: float, longitude_a: float, latitude_b: float, longitude_b: float):
+    """
+    This function returns the great circle distance between two positions in kilometres.
+    """
+    latitude_a, longitude_a, latitude_b, longitude_b = map(math.radians, (latitude_a, longitude_a, latitude_b, longitude_b))
+    a = math.sin((latitude_b - latitude_a) / 2) ** 2 + math.cos(latitude_a) * math.cos(latitude_b) * math.sin((longitude_b - longitude_a) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class GridIndex:
+    """
+    The GridIndex class is a spatial index that buckets stations into a uniform latitude/longitude grid.
+    A bounding box query only visits the grid cells overlapping the box, so its cost depends on the size of the box
+    and the number of stations inside it, not on the total number of stations.
+
+    Attributes:
+        cell_size (float): The width and height of a grid cell in degrees.
+        cells (dict): Maps a (row, column) grid cell to the list of stations inside it.
+    """
+
+    def __init__(self, stations=(), cell_size: float = GRID_CELL_SIZE):
+        """
+        The constructor for GridIndex class.
+
+        Args:
+            stations (iterable, optional): Objects with geo_latitude and geo_longitude attributes. Defaults to no stations.
+            cell_size (float, optional): The width and height of a grid cell in degrees. Defaults to GRID_CELL_SIZE.
+        """
+        self.cell_size = cell_size
+        self.cells = {}
+        self.size = 0
+        self.add(stations)
+
+    def __len__(self):
+        return self.size
+
+    def cell(self, latitude: float, longitude: float):
+        """
+        This method returns the grid cell containing a position.
+
+        Returns:
+            tuple: The (row, column) of the grid cell.
+        """
+        return math.floor(latitude / self.cell_size), math.floor(longitude / self.cell_size)
+
+    def add(self, stations):
+        """
+        This method adds stations to the index. Stations without coordinates are ignored.
+
+        Args:
+            stations (iterable): Objects with geo_latitude and geo_longitude attributes.
+        """
+        for station in stations:
+            if station.geo_latitude is None or station.geo_longitude is None:
+                continue
+            self.cells.setdefault(self.cell(station.geo_latitude, station.geo_longitude), []).append(station)
+            self.size += 1
+
+    def replace(self, old, new):
+        """
+        This method replaces a station in the index with another station at the same position.
+
+        Args:
+            old: The indexed station.
+            new: The station to index in its place.
+        """
+        if old.geo_latitude is None or old.geo_longitude is None:
+            return
+        members = self.cells[self.cell(old.geo_latitude, old.geo_longitude)]
+        members[next(position for position, station in enumerate(members) if station is old)] = new
+
+    def within_bbox(self, south: float, west: float, north: float, east: float):
+        """
+        This method returns the stations inside a bounding box.
+
+        Args:
+            south (float): The southern latitude of the box.
+            west (float): The western longitude of the box.
+            north (float): The northern latitude of the box.
+            east (float): The eastern longitude of the box.
+
+        Returns:
+            list: The stations inside the box.
+        """
+        first_row, first_column = self.cell(south, west)
+        last_row, last_column = self.cell(north, east)
+        if (last_row - first_row + 1) * (last_column - first_column + 1) > len(self.cells):
+            cells = [cell for cell in self.cells
+                     if first_row <= cell[0] <= last_row and first_column <= cell[1] <= last_column]
+        else:
+            cells = [(row, column) for row in range(first_row, last_row + 1) for column in range(first_column, last_column + 1)]
+        return [station
+                for cell in cells
+                for station in self.cells.get(cell, ())
+                if south <= station.geo_latitude <= north and west <= station.geo_longitude <= east]
+
+
+class KDTree:
+    """
+    The KDTree class is a three dimensional k-d tree over stations placed on the unit sphere.
+    The tree is stored implicitly in a list: each segment of the list is sorted along one axis, its middle element is the
+    node, and the halves before and after it are the subtrees. Nearest neighbour and radius queries visit O(log n) nodes
+    for typical data instead of every station.
+
+    Attributes:
+        points (list): The unit vectors of the stations, in tree order.
+        stations (list): The stations, in tree order.
+    """
+
+    def __init__(self, stations=()):
+        """
+        The constructor for KDTree class.
+
+        Args:
+            stations (iterable, optional): Objects with geo_latitude and geo_longitude attributes. Stations without coordinates are ignored.
+        """
+        entries = [(to_vector(station.geo_latitude, station.geo_longitude), station)
+                   for station in stations
+                   if station.geo_latitude is not None and station.geo_longitude is not None]
+        segments = [(0, len(entries), 0)]
+        while segments:
+            low, high, axis = segments.pop()
+            if high - low < 2:
+                continue
+            entries[low:high] = sorted(entries[low:high], key=lambda entry: entry[0][axis])
+            middle = (low + high) // 2
+            segments.append((low, middle, (axis + 1) % 3))
+            segments.append((middle + 1, high, (axis + 1) % 3))
+        self.points = [entry[0] for entry in entries]
+        self.stations = [entry[1] for entry in entries]
+
+    def __len__(self):
+        return len(self.stations)
+
+    def __search(self, target, bound, visit):
+        """
+        This private method walks the tree, nearest subtree first, and skips every subtree that lies further away from
+        the target than bound() along the splitting axis. visit is called with the squared chord distance and the position of each visited node.
+        """
+        stack = [(0, len(self.points), 0)]
+        while stack:
+            low, high, axis = stack.pop()
+            if low >= high:
+                continue
+            middle = (low + high) // 2
+            point = self.points[middle]
+            visit((target[0] - point[0]) ** 2 + (target[1] - point[1]) ** 2 + (target[2] - point[2]) ** 2, middle)
+            difference = target[axis] - point[axis]
+            near, far = ((low, middle), (middle + 1, high)) if difference < 0 else ((middle + 1, high), (low, middle))
+            if difference * difference <= bound():
+                stack.append((*far, (axis + 1) % 3))
+            stack.append((*near, (axis + 1) % 3))
+
+    def nearest(self, latitude: float, longitude: float, k: int = 1):
+        """
+        This method returns the k stations closest to a position.
+
+        Args:
+            latitude (float): The latitude of the position.
+            longitude (float): The longitude of the position.
+            k (int, optional): The number of stations to return. Defaults to 1.
+
+        Returns:
+            list: Tuples of the distance in kilometres and the station, closest first.
+        """
+        if k <= 0:
+            return []
+        heap = []
+
+        def bound():
+            return -heap[0][0] if len(heap) == k else math.inf
+
+        def visit(distance, position):
+            if len(heap) < k:
+                heapq.heappush(heap, (-distance, position))
+            elif distance < -heap[0][0]:
+                heapq.heapreplace(heap, (-distance, position))
+
+        self.__search(to_vector(latitude, longitude), bound, visit)
+        return [(chord_to_km(math.sqrt(-distance)), self.stations[position]) for distance, position in sorted(heap, reverse=True)]
+
+    def within_radius(self, latitude: float, longitude: float, radius: float):
+        """
+        This method returns the stations within a distance of a position.
+
+        Args:
+            latitude (float): The latitude of the position.
+            longitude (float): The longitude of the position.
+            radius (float): The distance in kilometres.
+
+        Returns:
+            list: Tuples of the distance in kilometres and the station, closest first.
+        """
+        limit = km_to_chord(radius) ** 2
+        found = []
+
+        def visit(distance, position):
+            if distance <= limit:
+                found.append((distance, position))
+
+        self.__search(to_vector(latitude, longitude), lambda: limit, visit)
+        return [(chord_to_km(math.sqrt(distance)), self.stations[position]) for distance, position in sorted(found)]
+
+
+class SpatialIndex:
+    """
+    The SpatialIndex class answers the position based station queries: the k nearest stations to a point,
+    the stations within a radius, and the stations within a bounding box.
+    It combines a KDTree for the distance queries with a GridIndex for the bounding box queries.
+
+    Attributes:
+        tree (KDTree): The index used for nearest and radius queries.
+        grid (GridIndex): The index used for bounding box queries.
+    """
+
+    def __init__(self, stations=()):
+        """
+        The constructor for SpatialIndex class.
+
+        Args:
+            stations (iterable, optional): Objects with geo_latitude and geo_longitude attributes. Defaults to no stations.
+        """
+        stations = list(stations)
+        self.tree = KDTree(stations)
+        self.grid = GridIndex(stations)
+
+    def __len__(self):
+        return len(self.tree)
+
+    def nearest(self, latitude: float, longitude: float, k: int = 1):
+        """
+        This method returns the k stations closest to a position as tuples of the distance in kilometres and the station, closest first.
+        """
+        return self.tree.nearest(latitude, longitude, k)
+
+    def within_radius(self, latitude: float, longitude: float, radius: float):
+        """
+        This method returns the stations within radius kilometres of a position as tuples of the distance in kilometres and the station, closest first.
+        """
+        return self.tree.within_radius(latitude, longitude, radius)
+
+    def within_bbox(self, south: float, west: float, north: float, east: float):
+        """
+        This method returns the stations inside a bounding box.
+        """
+        return self.grid.within_bbox(south, west, north, east)